@@ -0,0 +1,206 @@
+# audioRender.py
+# Audio previews of MIDI files, rendered by FluidSynth in worker processes, to review pieces before they reach the piano.
+
+from __future__ import annotations
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from workerPool import lowPriorityPool, midiFiles, staged
+
+RENDER_DIR = 'storage/.audio'
+SOUNDFONT_ENV = 'CHATPIANO_SOUNDFONT'
+DEFAULT_SOUNDFONT = 'storage/soundfont.sf2'
+SAMPLE_RATE = 44100
+# The preview head: this many seconds, rendered before the full piece.
+HEAD_SECONDS = 8.0
+# Bump when what a render produces changes.
+FORMAT_VERSION = 1
+
+# MIDI at the default tempo (120 bpm), so ticks are plain seconds.
+TICKS_PER_BEAT = 480
+TICKS_PER_SECOND = TICKS_PER_BEAT * 2
+
+def available(soundfont: str | None = None) -> bool:
+    return shutil.which('fluidsynth') is not None and os.path.isfile(soundfont or defaultSoundfont())
+
+def defaultSoundfont() -> str:
+    return os.environ.get(SOUNDFONT_ENV, DEFAULT_SOUNDFONT)
+
+def coreCount() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))   # the cores this process may use
+    return os.cpu_count() or 1
+
+class Render:
+    '''
+    `head` resolves to the path of the first `HEAD_SECONDS` as audio, `full` to the whole piece.
+    Without streaming, or once the full render is cached, `head` is the full render.
+    '''
+    def __init__(self, filename: str, head: Future[str], full: Future[str]):
+        self.filename = filename
+        self.head = head
+        self.full = full
+
+class AudioRenderer:
+    '''
+    Renders in a pool of `workers` processes (default: one per core), at low priority
+    so the scheduler keeps the CPU during a show. Results are cached under
+    `directory`, named by a hash of the MIDI bytes, soundfont and sample rate:
+    regenerating or copying a file does not render it again.
+    '''
+    def __init__(
+        self, soundfont: str | None = None, directory: str = RENDER_DIR,
+        workers: int | None = None, sample_rate: int = SAMPLE_RATE, head_seconds: float = HEAD_SECONDS,
+    ):
+        self.soundfont = soundfont or defaultSoundfont()
+        self.directory = directory
+        self.workers = workers or coreCount()
+        self.sample_rate = sample_rate
+        self.head_seconds = head_seconds
+        self._pool: ProcessPoolExecutor | None = None
+        self._in_flight: dict[str, Future[str]] = {}   # audio path -> its render
+        self._hashes: dict[tuple[str, int, int], str] = {}  # (path, size, mtime) -> content hash
+        self._lock = threading.Lock()
+
+    def key(self, filename: str) -> str:
+        stat = os.stat(filename)
+        identity = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        digest = self._hashes.get(identity)
+        if digest is None:
+            with open(filename, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            self._hashes[identity] = digest
+        font = os.stat(self.soundfont)
+        settings = f'{FORMAT_VERSION}|{os.path.abspath(self.soundfont)}|{font.st_size}|{font.st_mtime_ns}|{self.sample_rate}'
+        return hashlib.sha1(f'{digest}|{settings}'.encode()).hexdigest()
+
+    def render(self, filename: str, stream: bool = True) -> Render:
+        '''
+        Starts rendering `filename`, unless it is cached or already rendering.
+        With `stream`, the head is rendered first, so the piece can be auditioned sooner.
+        '''
+        key = self.key(filename)
+        full_path = os.path.join(self.directory, f'{key}.wav')
+        head = None
+        if stream and not os.path.isfile(full_path):
+            # submitted first, so a free worker takes it first
+            head = self._submit(os.path.join(self.directory, f'{key}.head.wav'), filename, self.head_seconds)
+        full = self._submit(full_path, filename, None)
+        return Render(filename, head or full, full)
+
+    def renderDirectory(self, directory: str = 'storage', stream: bool = False) -> list[Render]:
+        '''
+        Starts rendering every MIDI file under `directory`.
+        '''
+        renders = []
+        for filename in midiFiles(directory):
+            try:
+                renders.append(self.render(filename, stream))
+            except OSError as e:
+                print(f'Cannot render {filename}: {e}')
+        return renders
+
+    def watch(self, directory: str = 'storage', interval: float = 2.0) -> threading.Event:
+        '''
+        Renders new MIDI files under `directory` as they appear, on a daemon thread.
+        Set the returned event to stop watching.
+        '''
+        stop = threading.Event()
+        def loop():
+            while not stop.wait(interval):
+                self.renderDirectory(directory)
+        threading.Thread(target=loop, name='AudioRenderWatch', daemon=True).start()
+        return stop
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def _submit(self, audio_path: str, filename: str, head_seconds: float | None) -> Future[str]:
+        with self._lock:
+            future = self._in_flight.get(audio_path)
+            if future is not None:
+                return future
+            if os.path.isfile(audio_path):
+                future = Future()
+                future.set_result(audio_path)
+                return future
+            if self._pool is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._pool = lowPriorityPool(self.workers)
+            future = self._pool.submit(
+                renderFile, filename, audio_path, self.soundfont, self.sample_rate, head_seconds,
+            )
+            self._in_flight[audio_path] = future
+        future.add_done_callback(lambda _: self._settle(audio_path))
+        return future
+
+    def _settle(self, audio_path: str):
+        with self._lock:
+            self._in_flight.pop(audio_path, None)
+
+def renderFile(
+    filename: str, audio_path: str, soundfont: str, sample_rate: int = SAMPLE_RATE,
+    head_seconds: float | None = None,
+) -> str:
+    '''
+    Runs in a worker process. Renders `filename`, or its first `head_seconds`, to `audio_path`.
+    '''
+    from midi2audio import FluidSynth
+    source = filename
+    try:
+        if head_seconds is not None:
+            fd, source = tempfile.mkstemp(dir=os.path.dirname(audio_path), prefix='.head-', suffix='.mid')
+            os.close(fd)
+            writeHead(filename, source, head_seconds)
+        with staged(audio_path) as staging:
+            # midi2audio ignores the exit status; an empty file means it failed
+            FluidSynth(soundfont, sample_rate).midi_to_audio(source, staging)
+            if os.path.getsize(staging) == 0:
+                raise RuntimeError(f'FluidSynth rendered nothing for {filename}.')
+    finally:
+        if source != filename:
+            os.remove(source)
+    return audio_path
+
+def writeHead(filename: str, head_filename: str, seconds: float):
+    '''
+    Writes the first `seconds` of `filename` as a MIDI file, with held notes and pedals released at the cut.
+    '''
+    import mido
+    from midiSchedule import compileMidi, packPayloads
+    timeline = compileMidi(filename)   # already off the player's process
+    cursor = int(timeline.events['time'].searchsorted(seconds, side='right'))
+    payloads = packPayloads(timeline.events[:cursor])
+    times = timeline.events['time'][:cursor].tolist()
+    release = timeline.checkpoints.stateAt(cursor).silenceMessages()
+    payloads.extend(release)
+    times.extend([seconds] * len(release))
+    track = mido.MidiTrack()
+    tick = 0
+    for t, payload in zip(times, payloads):
+        at = round(t * TICKS_PER_SECOND)
+        track.append(mido.Message.from_bytes(payload, time=at - tick))
+        tick = at
+    mid = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    mid.tracks.append(track)
+    mid.save(head_filename)
+
+default = AudioRenderer()
+
+if __name__ == '__main__':
+    import sys
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'storage'
+    for render in default.renderDirectory(directory):
+        try:
+            print(render.filename, '->', render.full.result())
+        except Exception as e:
+            print(f'Cannot render {render.filename}: {e}')
+    default.close()
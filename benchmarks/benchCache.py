@@ -0,0 +1,71 @@
+# benchmarks/benchCache.py
+# Time to first note for a long piece: parsing with mido (cold) vs. the memory-mapped timeline cache (warm),
+# and the lateness of a playing piece while another file compiles on a thread vs. in the compiler process.
+# Usage: python benchmarks/benchCache.py [minutes] [notes_per_second]
+
+import sys
+import os
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+from fakes import FakeOutput, makeDenseMidi, percentiles
+import midiSchedule
+from timelineCache import TimelineCache
+
+def timeToFirstNote(load, filename: str) -> float:
+    port = FakeOutput()
+    scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port))
+    scheduler.start()
+    start = perf_counter()
+    timeline = load(filename)
+    stream = scheduler.add(timeline)
+    while port.sent == 0:
+        sleep(1e-4)     # not a busy loop, which would hold the GIL against the scheduler
+    scheduler.cancel(stream)
+    stream.done.wait()
+    scheduler.stop()
+    return port.stamps[0] - start
+
+def latenessWhileCompiling(compile, timeline: midiSchedule.Timeline) -> list[float]:
+    port = FakeOutput()
+    scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port))
+    scheduler.start()
+    stream = scheduler.add(timeline)
+    compiling = threading.Thread(target=compile)
+    compiling.start()
+    stream.done.wait()
+    compiling.join()
+    scheduler.stop()
+    origin = stream.time_map[0]
+    return [port.stamps[i] - origin - t for i, t in enumerate(timeline.events['time'].tolist())]
+
+def main():
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    density = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = makeDenseMidi(os.path.join(tmp, 'long.mid'), minutes * 60, density)
+        cache = TimelineCache(os.path.join(tmp, 'cache'))
+        print(f'{os.path.getsize(filename) / 2**20:.1f} MiB MIDI, {len(midiSchedule.compileMidi(filename))} events')
+        print(f'no cache      {timeToFirstNote(midiSchedule.compileMidi, filename) * 1e3:8.1f} ms')
+        print(f'cold cache    {timeToFirstNote(cache.load, filename) * 1e3:8.1f} ms')
+        started = TimelineCache(os.path.join(tmp, 'started'))
+        started.warmUp(os.path.join(tmp, 'cache'))     # no MIDI files: only starts the compiler
+        print(f'cold, started {timeToFirstNote(started.load, filename) * 1e3:8.1f} ms')
+        started.close()
+        print(f'warm cache    {timeToFirstNote(cache.load, filename) * 1e3:8.1f} ms')
+        cache.max_bytes = 0
+        cache.warmUp(tmp)   # the newest entry survives eviction
+        print(f'after warmUp  {timeToFirstNote(cache.load, filename) * 1e3:8.1f} ms')
+        playing = midiSchedule.compileMidi(makeDenseMidi(os.path.join(tmp, 'short.mid'), 5, 400))
+        playing.payloads
+        for name, compile in (
+            ('idle', lambda: None), 
+            ('compile on a thread', lambda: midiSchedule.compileMidi(filename)), 
+            ('compiler process', lambda: TimelineCache(os.path.join(tmp, 'fresh')).load(filename)), 
+        ):
+            print(f'lateness, {name:20}{percentiles(latenessWhileCompiling(compile, playing))}')
+        cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# benchmarks/benchFollower.py
+# Replays a simulated soloist (rubato, timing jitter, wrong / missed / extra notes)
+# through the ScoreFollower and reports alignment accuracy and per-onset processing time.
+# With --realtime, the performance goes through a virtual MIDI port in real time instead
+# (needs a mido backend with virtual ports, e.g. rtmidi on Linux / macOS), while a Scheduler
+# plays the accompaniment on a fake port; reports the time from each onset to the accompaniment.
+# With --recorded, a recorded performance is sent that way, following the given score
+# (default: the app's accompaniment score, solo on its SOLO_CHANNEL).
+# Usage: python benchmarks/benchFollower.py [n_notes] [--realtime] [--recorded performance.mid [score.mid]]
+
+import sys
+import math
+import random
+import threading
+from time import perf_counter, sleep
+
+import numpy as np
+import mido
+
+from fakes import FakeOutput, percentiles
+from midiSchedule import EVENT_DTYPE, Timeline, Scheduler, compileMidi, rawSender
+from scoreFollower import CHORD_SPREAD, ScoreFollower, soloOnsets, splitChannel
+from functions import ACCOMPANIMENT_SCORE, SOLO_CHANNEL
+
+def makeSolo(n_notes: int, seed: int = 0) -> Timeline:
+    '''
+    A stepwise melody with some chords and repeated notes, channel 0.
+    '''
+    rng = random.Random(seed)
+    rows = []
+    t = 0.0
+    pitch = 67
+    for _ in range(n_notes):
+        pitch = min(max(pitch + rng.choice((-2, -1, 0, 1, 2, 3, -3)), 55), 84)
+        chord = [pitch] if rng.random() > .15 else [pitch, pitch - 4, pitch - 7]
+        duration = rng.choice((.125, .25, .25, .5))
+        for p in chord:
+            rows.append((t, 0x90, p, 80))
+            rows.append((t + duration * .9, 0x80, p, 0))
+        t += duration
+    rows.sort(key=lambda r: r[0])
+    return Timeline(np.array(rows, dtype=EVENT_DTYPE))
+
+def makeAccompaniment(solo: Timeline) -> Timeline:
+    '''
+    A bass note on channel 1 under every solo onset.
+    '''
+    onset_times, pitch_table = soloOnsets(solo)
+    rows = []
+    for t, pitches in zip(onset_times.tolist(), pitch_table):
+        bass = int(np.flatnonzero(pitches)[0]) - 24
+        rows.append((t, 0x91, bass, 70))
+        rows.append((t + .1, 0x81, bass, 0))
+    rows.sort(key=lambda r: r[0])
+    return Timeline(np.array(rows, dtype=EVENT_DTYPE))
+
+def perform(solo: Timeline, seed: int = 1):
+    '''
+    Returns [(wall time, pitch, true onset index or -1)], sorted by wall time.
+    '''
+    rng = random.Random(seed)
+    onset_times, pitch_table = soloOnsets(solo)
+    played = []
+    wall = 0.0
+    for j, t in enumerate(onset_times):
+        if j:
+            # rubato: the tempo drifts between 0.75x and 1.3x over the piece
+            rate = 1.0 + .25 * math.sin(t / 8) + .05 * math.sin(t * 1.7)
+            wall += (t - onset_times[j - 1]) / rate
+        for pitch in np.flatnonzero(pitch_table[j]).tolist():
+            roll = rng.random()
+            if roll < .03:
+                continue    # missed
+            if roll < .06:
+                pitch += rng.choice((-1, 1))    # wrong note
+            played.append((wall + rng.gauss(0, .015), pitch, j))
+        if rng.random() < .03:
+            played.append((wall + rng.uniform(0, .1), rng.randrange(50, 90), -1))  # extra note
+    played.sort()
+    return played
+
+def loadPerformance(filename: str):
+    '''
+    The note-ons of a recorded performance, like perform() returns them, with the true onsets unknown (-1).
+    '''
+    played = []
+    wall = 0.0
+    for msg in mido.MidiFile(filename):
+        wall += msg.time
+        if msg.type == 'note_on' and msg.velocity:
+            played.append((wall, msg.note, -1))
+    return played
+
+def replayOffline(follower: ScoreFollower, played):
+    positions = []
+    costs = []
+    for wall, pitch, _ in played:
+        start = perf_counter()
+        follower.onset(pitch, wall)
+        costs.append(perf_counter() - start)
+        positions.append(follower.position)
+    return positions, costs
+
+def replayRealtime(follower: ScoreFollower, played, accompaniment: Timeline):
+    '''
+    Sends `played` through a virtual port in real time, re-timing `accompaniment`,
+    which plays on a FakeOutput under a running Scheduler, as MidiPlayer.accompany() does.
+    Returns (positions, costs, lateness, ahead), over the onsets that anchor the
+    alignment and have accompaniment at their score time. Lateness runs from the
+    onset to the next accompaniment send, when the retime brought that forward;
+    `ahead` is how long before the onset the accompaniment had already played it.
+    '''
+    output = FakeOutput()
+    scheduler = Scheduler(rawSender(output))
+    scheduler.start()
+    enter = None
+    if len(follower.onset_times) and (
+        len(accompaniment) == 0 or follower.onset_times[0] <= accompaniment.events['time'][0]
+    ):
+        enter = math.inf  # the soloist enters first; wait
+    stream = scheduler.add(accompaniment, enter)
+    positions = []
+    costs = []
+    anchors = []    # (arrival, messages sent before the retime, score time)
+    done = threading.Event()
+    def onMessage(msg):
+        if msg.type != 'note_on' or msg.velocity == 0:
+            return
+        start = perf_counter()
+        time_map = follower.onset(msg.note, start)
+        costs.append(perf_counter() - start)
+        if time_map is not None:
+            anchors.append((start, output.sent, float(follower.onset_times[follower.position])))
+            scheduler.retime(stream, *time_map)
+        positions.append(follower.position)
+        if len(positions) == len(played):
+            done.set()
+    with mido.open_input('benchFollower', virtual=True, callback=onMessage):  # type: ignore
+        with mido.open_output('benchFollower') as port:  # type: ignore
+            origin = perf_counter()
+            for wall, pitch, _ in played:
+                delay = origin + wall - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                port.send(mido.Message('note_on', note=pitch, velocity=80))
+            done.wait(5)
+    sent = output.sent
+    scheduler.cancel(stream)
+    stream.done.wait()
+    scheduler.stop()
+    # one stream, no seeks: the i-th message sent is the i-th event
+    times = accompaniment.events['time']
+    lateness = []
+    ahead = []
+    for start, before, score_time in anchors:
+        i = int(times.searchsorted(score_time - CHORD_SPREAD))
+        if i >= sent or times[i] > score_time + CHORD_SPREAD:
+            continue
+        if i >= before:
+            lateness.append(output.stamps[before] - start)
+        else:
+            ahead.append(start - output.stamps[i])
+    return positions, costs, lateness, ahead
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 2000
+    if '--recorded' in sys.argv:
+        i = sys.argv.index('--recorded')
+        played = loadPerformance(sys.argv[i + 1])
+        score = sys.argv[i + 2] if len(sys.argv) > i + 2 else ACCOMPANIMENT_SCORE
+        solo, accompaniment = splitChannel(compileMidi(score), SOLO_CHANNEL)
+    else:
+        solo = makeSolo(n_notes)
+        accompaniment = makeAccompaniment(solo)
+        played = perform(solo)
+    follower = ScoreFollower(solo)
+    if '--realtime' in sys.argv or '--recorded' in sys.argv:
+        positions, costs, lateness, ahead = replayRealtime(follower, played, accompaniment)
+    else:
+        positions, costs = replayOffline(follower, played)
+        lateness = None
+    onset_times = follower.onset_times
+    print(f'{len(onset_times)} score onsets, {len(played)} performed notes')
+    truth = [j for _, _, j in played]
+    scored = [(p, j) for p, j in zip(positions, truth) if j >= 0]
+    if scored:  # a recorded performance has no ground truth
+        exact = sum(p == j for p, j in scored) / len(scored)
+        near = sum(abs(p - j) <= 1 for p, j in scored) / len(scored)
+        error = [abs(onset_times[max(p, 0)] - onset_times[j]) for p, j in scored]
+        print(f'position exact {exact:.1%}   within one onset {near:.1%}')
+        print(f'score-time error       {percentiles(error)}')
+    print(f'processing per onset   {percentiles(costs)}')
+    if lateness is not None:
+        print(f'onset to accompaniment {percentiles(lateness)}   ({len(lateness)} onsets)')
+        print(f'accompaniment ahead by {percentiles(ahead)}   ({len(ahead)} onsets)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/benchGapless.py
+# The silence between consecutive pieces: one port and thread per piece (the old MidiPlayer.play)
+# vs. PlaybackService on one long-lived port, replayed into a fake port.
+# Usage: python benchmarks/benchGapless.py [n_pieces] [seconds_per_piece]
+
+import sys
+import os
+import tempfile
+import threading
+
+import mido
+
+from fakes import FakeOutput, makeDenseMidi, percentiles
+import playbackService
+from timelineCache import TimelineCache
+import timelineCache
+
+def legacyPiece(filename: str, stamps: list[float]):
+    '''
+    A fresh port, a fresh thread and a fresh parse per piece, as startPlaying used to do.
+    '''
+    def play():
+        port = FakeOutput()
+        with mido.MidiFile(filename) as mid:
+            for msg in mid.play():
+                port.send(msg)
+        stamps.extend(port.stamps[:port.sent])
+    thread = threading.Thread(target=play)
+    thread.start()
+    thread.join()
+
+def main():
+    n_pieces = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = [
+            makeDenseMidi(os.path.join(tmp, f'{k}.mid'), seconds, 100, seed=k) for k in range(n_pieces)
+        ]
+        # every piece ends exactly on its last event, so any gap is the player's
+        legacy = []
+        for filename in filenames:
+            stamps: list[float] = []
+            legacyPiece(filename, stamps)
+            legacy.append(stamps)
+        print(f'port per piece     gap {percentiles([b[0] - a[-1] for a, b in zip(legacy, legacy[1:])])}')
+
+        timelineCache.default = TimelineCache(os.path.join(tmp, 'cache'))
+        port = FakeOutput()
+        service = playbackService.PlaybackService(port)
+        pieces = [service.enqueue(filename) for filename in filenames]
+        for piece in pieces:
+            piece.wait()
+        boundaries = [0]
+        for piece in pieces:
+            boundaries.append(boundaries[-1] + len(piece.stream.times))
+        stamps = port.stamps
+        print(f'PlaybackService    gap {percentiles([stamps[b] - stamps[b - 1] for b in boundaries[1:-1]])}')
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/benchJobs.py
+# Throughput and completion-to-notification latency of generation jobs against a
+# local stand-in server: the old thread-per-job 10 s polling vs. GenerationJobManager.
+# Usage: python benchmarks/benchJobs.py [n_jobs] [--skip-legacy]
+
+import sys
+import os
+import io
+import time
+import tempfile
+import threading
+import contextlib
+from time import perf_counter
+
+import requests
+
+from fakes import percentiles
+from standInServer import StandInServer
+import generateMidiTool
+
+def legacyConvert(base_url: str, text: str, storage: str, notified: dict):
+    '''
+    The pipeline generate_midi ran on its own thread before the job manager.
+    '''
+    job_id = requests.post(f'{base_url}/submit-text', json={'text': text}).json()['jobId']
+    while requests.get(f'{base_url}/check-status/{job_id}').json()['status'] != 'completed':
+        time.sleep(10)
+    requests.get(f'{base_url}/get-result/{job_id}').json()
+    response = requests.get(f'{base_url}/download-midi/{job_id}', stream=True)
+    with open(os.path.join(storage, f'{job_id}.mid'), 'wb') as f:
+        for chunk in response.iter_content(chunk_size=8192):
+            f.write(chunk)
+    notified[job_id] = perf_counter()
+
+def runLegacy(server: StandInServer, n_jobs: int, storage: str) -> dict:
+    notified = {}
+    threads = [
+        threading.Thread(target=legacyConvert, args=(server.base_url, f'piece {i}', storage, notified))
+        for i in range(n_jobs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return notified
+
+def runManager(server: StandInServer, n_jobs: int, storage: str) -> dict:
+    client = generateMidiTool.TextToMidiClient(server.base_url)
+    manager = generateMidiTool.GenerationJobManager(client, storage_dir=storage)
+    notified = {}
+    def onDone(job):
+        notified[job.server_job_id] = perf_counter()
+    jobs = []
+    for i in range(n_jobs):
+        job = manager.submit(f'piece {i}')
+        job.callbacks.append(onDone)
+        jobs.append(job)
+    for job in jobs:
+        job.done.wait()
+        assert job.status == 'completed', job.error
+    return notified
+
+def main():
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 50
+    runs = [('job manager', runManager)]
+    if '--skip-legacy' not in sys.argv:
+        runs.insert(0, ('legacy threads', runLegacy))
+    for name, run in runs:
+        server = StandInServer()
+        with tempfile.TemporaryDirectory() as storage, contextlib.redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            notified = run(server, n_jobs, storage)
+            elapsed = perf_counter() - start
+        server.shutdown()
+        latency = [notified[job_id] - server.completed_at[job_id] for job_id in notified]
+        print(f'{name:15} {n_jobs / elapsed:6.2f} jobs/s   notification latency {percentiles(latency)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/benchRender.py
+# Renders per minute of audioRender as the worker count grows, with a tiny generated soundfont,
+# and how much sooner the streamed head is ready than the full render.
+# Needs the fluidsynth command line program.
+# Usage: python benchmarks/benchRender.py [n_files] [seconds_per_file]
+
+import sys
+import os
+import math
+import shutil
+import struct
+import tempfile
+from time import perf_counter
+
+from fakes import makeDenseMidi
+import audioRender
+
+def chunk(name: bytes, data: bytes) -> bytes:
+    if len(data) % 2:
+        data += b'\0'
+    return name + struct.pack('<I', len(data)) + data
+
+def listChunk(kind: bytes, *chunks: bytes) -> bytes:
+    return chunk(b'LIST', kind + b''.join(chunks))
+
+def writeSineSoundfont(filename: str, sample_rate: int = 44100) -> str:
+    '''
+    A valid SF2 with one preset (bank 0, program 0): a looped 441 Hz sine on every key.
+    '''
+    period = sample_rate // 441
+    n = period * 100
+    samples = [round(12000 * math.sin(2 * math.pi * i / period)) for i in range(n)]
+    smpl = struct.pack(f'<{n + 46}h', *samples, *[0] * 46)     # SF2 wants 46 zeros after each sample
+    name = lambda s: s.encode().ljust(20, b'\0')
+    sf2 = chunk(b'RIFF', b'sfbk' + listChunk(
+        b'INFO',
+        chunk(b'ifil', struct.pack('<HH', 2, 1)),
+        chunk(b'isng', b'EMU8000\0'),
+        chunk(b'INAM', b'Bench sine\0'),
+    ) + listChunk(b'sdta', chunk(b'smpl', smpl)) + listChunk(
+        b'pdta',
+        chunk(b'phdr', struct.pack('<20sHHHIII', name('Sine'), 0, 0, 0, 0, 0, 0)
+            + struct.pack('<20sHHHIII', name('EOP'), 0, 0, 1, 0, 0, 0)),
+        chunk(b'pbag', struct.pack('<HHHH', 0, 0, 1, 0)),
+        chunk(b'pmod', bytes(10)),
+        chunk(b'pgen', struct.pack('<HH', 41, 0) + bytes(4)),      # instrument 0
+        chunk(b'inst', struct.pack('<20sH', name('Sine'), 0) + struct.pack('<20sH', name('EOI'), 1)),
+        chunk(b'ibag', struct.pack('<HHHH', 0, 0, 2, 0)),
+        chunk(b'imod', bytes(10)),
+        chunk(b'igen', struct.pack('<HH', 54, 1) + struct.pack('<HH', 53, 0) + bytes(4)),  # loop, sample 0
+        chunk(b'shdr', struct.pack(
+            '<20sIIIIIBbHH', name('Sine'), 0, n, period * 10, period * 90, sample_rate, 69, 0, 0, 1,
+        ) + struct.pack('<20sIIIIIBbHH', name('EOS'), 0, 0, 0, 0, 0, 0, 0, 0, 0)),
+    ))
+    with open(filename, 'wb') as f:
+        f.write(sf2)
+    return filename
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+    if shutil.which('fluidsynth') is None:
+        print('This benchmark needs the fluidsynth program on PATH.')
+        sys.exit(1)
+    cores = audioRender.coreCount()
+    counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    with tempfile.TemporaryDirectory() as tmp:
+        soundfont = writeSineSoundfont(os.path.join(tmp, 'sine.sf2'))
+        pieces = os.path.join(tmp, 'pieces')
+        os.makedirs(pieces)
+        for i in range(n_files):
+            makeDenseMidi(os.path.join(pieces, f'{i}.mid'), seconds, 20, seed=i)
+        print(f'{n_files} files of {seconds:.0f} s, {cores} cores')
+        for workers in counts:
+            renderer = audioRender.AudioRenderer(
+                soundfont, directory=os.path.join(tmp, f'audio{workers}'), workers=workers,
+            )
+            renderer.render(os.path.join(pieces, '0.mid'), stream=False).full.result()  # start the workers
+            start = perf_counter()
+            for render in renderer.renderDirectory(pieces):
+                render.full.result()
+            elapsed = perf_counter() - start
+            print(f'{workers:2} workers{(n_files - 1) / elapsed * 60:10.1f} renders/min')
+            # cached: no worker runs
+            start = perf_counter()
+            renderer.renderDirectory(pieces)
+            cached = perf_counter() - start
+            renderer.close()
+        print(f'cached pass over the directory {cached * 1e3:.1f} ms')
+        renderer = audioRender.AudioRenderer(soundfont, directory=os.path.join(tmp, 'streamed'), workers=1)
+        renderer.render(os.path.join(pieces, '0.mid'), stream=False).full.result()
+        start = perf_counter()
+        render = renderer.render(os.path.join(pieces, '1.mid'))
+        render.head.result()
+        head = perf_counter() - start
+        render.full.result()
+        full = perf_counter() - start
+        renderer.close()
+        print(f'streamed: first {audioRender.HEAD_SECONDS:.0f} s playable after {head * 1e3:.0f} ms, whole piece after {full * 1e3:.0f} ms')
+
+if __name__ == '__main__':
+    main()
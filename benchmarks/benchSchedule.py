@@ -0,0 +1,58 @@
+# benchmarks/benchSchedule.py
+# Lateness of the compiled Scheduler vs. the old `mid.play()` loop, replayed into a fake port.
+# Usage: python benchmarks/benchSchedule.py [seconds] [notes_per_second]
+
+import sys
+import os
+import io
+import tempfile
+import contextlib
+from time import perf_counter
+
+import mido
+
+from fakes import FakeOutput, makeDenseMidi, percentiles
+import midiSchedule
+
+def legacyPlay(filename: str, port: FakeOutput) -> float:
+    '''
+    The loop `MidiPlayer.play` used before the Scheduler. Returns the start time.
+    '''
+    with mido.MidiFile(filename) as mid, contextlib.redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        for msg in mid.play():
+            print(msg)
+            try:
+                msg.velocity = round(msg.velocity * 1.0)
+                msg.channel = msg.channel
+            except AttributeError:
+                pass
+            port.send(msg)
+    return start
+
+def schedulerPlay(filename: str, port: FakeOutput) -> float:
+    timeline = midiSchedule.compileMidi(filename)
+    timeline.payloads
+    scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port))
+    scheduler.start()
+    stream = scheduler.add(timeline)
+    stream.done.wait()
+    scheduler.stop()
+    return stream.time_map[0]
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    density = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = makeDenseMidi(os.path.join(tmp, 'dense.mid'), seconds, density)
+        times = midiSchedule.compileMidi(filename).events['time'].tolist()
+        print(f'{len(times)} events over {times[-1]:.1f} s')
+        for name, play in (('mid.play()', legacyPlay), ('Scheduler', schedulerPlay)):
+            port = FakeOutput()
+            origin = play(filename, port)
+            assert port.sent >= len(times)   # plus any release at the end
+            lateness = [port.stamps[i] - origin - t for i, t in enumerate(times)]
+            print(f'{name:12}{percentiles(lateness)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/benchSeek.py
+# Seek cost with checkpoints vs. rescanning from the start, and how fast stop silences the piano.
+# First checks that checkpointed states match an event-by-event replay.
+# Exits with 1 if any stop takes longer than the budget to silence the piano.
+# Usage: python benchmarks/benchSeek.py [minutes] [budget_ms]
+
+import sys
+import os
+import random
+import tempfile
+from time import perf_counter, sleep
+
+import numpy as np
+
+from fakes import FakeOutput, makeDenseMidi, percentiles
+import midiSchedule
+import playbackService
+
+def randomEvents(rng: random.Random, n: int = 5000) -> np.ndarray:
+    '''
+    Notes, controllers (resets and all-notes-off included), programs and bends on two channels.
+    '''
+    rows = []
+    for i in range(n):
+        channel = rng.randrange(2)
+        kind = rng.choice((0x90, 0x90, 0x80, 0xB0, 0xB0, 0xC0, 0xE0))
+        if kind == 0xB0:
+            number = rng.choice((0, 1, 7, 10, 11, 32, 64, 64, 66, 91, 120, 121, 121, 123))
+            rows.append((i, kind | channel, number, rng.randrange(128)))
+        else:
+            rows.append((i, kind | channel, rng.randrange(128), rng.randrange(128)))
+    return np.array(rows, dtype=midiSchedule.EVENT_DTYPE)
+
+def checkChunking(rng: random.Random):
+    events = randomEvents(rng)
+    chunked = midiSchedule.Checkpoints(events)
+    replayed = midiSchedule.Checkpoints(events, every=1)
+    for cursor in rng.sample(range(len(events) + 1), 500):
+        a, b = chunked.stateAt(cursor), replayed.stateAt(cursor)
+        for field in ('velocity', 'cc', 'program', 'bend', 'reset'):
+            assert np.array_equal(getattr(a, field), getattr(b, field)), (cursor, field)
+    print('checkpointed states match an event-by-event replay')
+
+def main():
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    budget = float(sys.argv[2]) / 1e3 if len(sys.argv) > 2 else 0.01
+    rng = random.Random(0)
+    checkChunking(rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        timeline = midiSchedule.compileMidi(makeDenseMidi(os.path.join(tmp, 'long.mid'), minutes * 60, 40))
+    print(f'{len(timeline)} events, {len(timeline.bars)} bars, {timeline.duration / 60:.0f} min')
+    start = perf_counter()
+    checkpoints = timeline.checkpoints
+    print(f'checkpoint index built in {(perf_counter() - start) * 1e3:.1f} ms')
+
+    targets = [rng.uniform(0, timeline.duration) for _ in range(200)]
+    times = timeline.events['time']
+    def rescan(cursor: int):
+        state = midiSchedule.ControllerState()
+        state.advance(timeline.events[:cursor])
+        return state
+    for name, stateAt in (('rescan', rescan), ('checkpoints', checkpoints.stateAt)):
+        costs = []
+        for target in targets:
+            begin = perf_counter()
+            state = stateAt(int(times.searchsorted(target)))
+            state.restoreMessages()
+            costs.append(perf_counter() - begin)
+        print(f'seek state, {name:12} {percentiles(costs)}')
+
+    port = FakeOutput()
+    playback = playbackService.PlaybackService(port)
+    scheduler = playback.scheduler
+    # seek: from the call to the first message at the new position
+    seek_latency = []
+    stream = scheduler.add(timeline)
+    for target in targets[:50]:
+        sleep(rng.uniform(.01, .05))
+        sent = port.sent
+        begin = perf_counter()
+        scheduler.seek(stream, target, perf_counter())
+        while port.sent == sent:
+            sleep(1e-5)
+        seek_latency.append(port.stamps[sent] - begin)
+    scheduler.cancel(stream)
+    stream.done.wait()
+    print(f'seek, call to first message  {percentiles(seek_latency)}')
+    # stop: from stopAll() to the last release message
+    stop_latency = []
+    for target in targets[:50]:
+        piece = playback.attach(timeline, perf_counter() - target)
+        sleep(rng.uniform(.05, .2))
+        begin = perf_counter()
+        playback.stopAll()
+        piece.stream.done.wait()
+        stop_latency.append(port.stamps[port.sent - 1] - begin)
+        assert port.silent()
+    print(f'stop, call to silence        {percentiles(stop_latency)}')
+    playback.close()
+    if max(stop_latency) > budget:
+        print(f'Stop took up to {max(stop_latency) * 1e3:.1f} ms, over the {budget * 1e3:.0f} ms budget.')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
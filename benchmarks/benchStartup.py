@@ -0,0 +1,67 @@
+# benchmarks/benchStartup.py
+# Import time of the tool registry and time until the player is ready, each in a fresh interpreter.
+# Ports come from benchmarks/fakeBackend.py. Exits with 1 if the registry takes longer than the budget.
+# Usage: python benchmarks/benchStartup.py [runs] [budget_ms]
+
+import sys
+import os
+import json
+import statistics
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+CHILD = '''
+import json
+from time import perf_counter
+start = perf_counter()
+stamps = {}
+import functions
+stamps['import functions'] = perf_counter() - start
+if MODE == 'eager':
+    # what importing functions.py used to pull in
+    import generateMidiTool, playbackService, scoreFollower, timelineCache, perfStats
+    stamps['import everything'] = perf_counter() - start
+else:
+    player = functions.MidiPlayer(output_port='disklavier', input_port='keyboard')
+    stamps['registry ready'] = perf_counter() - start
+    player.waitReady()
+    stamps['port open'] = perf_counter() - start
+    before = perf_counter()
+    import generateMidiTool
+    stamps['first generation call, import'] = perf_counter() - before
+print(json.dumps(stamps))
+'''
+
+def runChild(mode: str, cwd: str) -> dict[str, float]:
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([ROOT, HERE]),
+        MIDO_BACKEND='fakeBackend',
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', f'MODE = {mode!r}\n' + CHILD],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    budget = float(sys.argv[2]) / 1e3 if len(sys.argv) > 2 else 0.05
+    with tempfile.TemporaryDirectory() as cwd:  # an empty storage/ to warm up
+        runChild('lazy', cwd)   # compile bytecode first
+        for mode in ('eager', 'lazy'):
+            samples = [runChild(mode, cwd) for _ in range(runs)]
+            for stage in samples[0]:
+                median = statistics.median(s[stage] for s in samples)
+                print(f'{mode:6}{stage:32}{median * 1e3:8.1f} ms')
+            if mode == 'lazy':
+                ready = statistics.median(s['registry ready'] for s in samples)
+    if ready > budget:
+        print(f'Registry ready in {ready * 1e3:.1f} ms, over the {budget * 1e3:.0f} ms budget.')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
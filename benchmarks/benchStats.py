@@ -0,0 +1,52 @@
+# benchmarks/benchStats.py
+# Cost of the always-on instrumentation: per-call record() and Scheduler lateness with and without it.
+# Usage: python benchmarks/benchStats.py [seconds] [notes_per_second]
+
+import sys
+import os
+import json
+import tempfile
+from time import perf_counter
+
+from fakes import FakeOutput, makeDenseMidi, percentiles
+import midiSchedule
+import perfStats
+
+def recordCost(calls: int = 1_000_000) -> float:
+    '''
+    Seconds per record(), folds included.
+    '''
+    recorder = perfStats.EventRecorder()
+    record = recorder.record
+    start = perf_counter()
+    for _ in range(calls):
+        record(0.0, 1e-4, 2e-4)
+    return (perf_counter() - start) / calls
+
+def play(timeline: midiSchedule.Timeline, recorder) -> list[float]:
+    port = FakeOutput()
+    scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port), recorder=recorder)
+    scheduler.start()
+    stream = scheduler.add(timeline)
+    stream.done.wait()
+    scheduler.stop()
+    origin = stream.time_map[0]
+    times = timeline.events['time'].tolist()
+    assert port.sent >= len(times)   # plus any release at the end
+    return [port.stamps[i] - origin - t for i, t in enumerate(times)]
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    density = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    print(f'record(): {recordCost() * 1e9:.0f} ns per call')
+    with tempfile.TemporaryDirectory() as tmp:
+        timeline = midiSchedule.compileMidi(makeDenseMidi(os.path.join(tmp, 'dense.mid'), seconds, density))
+        timeline.payloads
+        print(f'{len(timeline.events)} events over {timeline.duration:.1f} s')
+        recorder = perfStats.EventRecorder()
+        for name, r in (('no recorder', None), ('recorder', recorder)):
+            print(f'{name:12}{percentiles(play(timeline, r))}')
+        print(json.dumps(recorder.toDict(recent=4), indent=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/benchTransform.py
+# Cost of the midiTransform pipeline on a very large timeline, vs. the old per-message transform,
+# and a check that playback runs no transform code at all.
+# Usage: python benchmarks/benchTransform.py [millions_of_events]
+
+import sys
+import threading
+from collections import Counter
+from time import perf_counter
+
+import numpy as np
+import mido
+
+from fakes import FakeOutput
+import midiSchedule
+import midiTransform as mt
+
+def randomTimeline(n: int, seed: int = 0) -> midiSchedule.Timeline:
+    rng = np.random.default_rng(seed)
+    events = np.empty(n, dtype=midiSchedule.EVENT_DTYPE)
+    events['time'] = np.cumsum(rng.exponential(.01, n))
+    events['status'] = rng.choice([0x80, 0x90, 0x90, 0xB0], n) | rng.integers(0, 4, n)
+    events['data1'] = rng.integers(0, 128, n)
+    events['data2'] = rng.integers(0, 128, n)
+    return midiSchedule.Timeline(events)
+
+def pipeline() -> mt.Pipeline:
+    return mt.Pipeline(
+        mt.ChannelMap({3: None, 2: 0}), 
+        mt.VelocityCurve.gamma(1.3), 
+        mt.Transpose(-2), 
+        mt.ClampRange(), 
+        mt.FilterCC(only=(64, 67)), 
+    )
+
+def legacyPerMessage(messages: list[mido.Message]):
+    '''
+    What MidiPlayer.play used to do for each message, on the playback thread.
+    '''
+    channel_remap = lambda x: x
+    for msg in messages:
+        try:
+            msg.velocity = round(msg.velocity * 1.1 / 1.1)
+            new_channel = channel_remap(msg.channel)
+            if new_channel is None:
+                continue
+            msg.channel = new_channel
+        except AttributeError:
+            pass
+
+def main():
+    n = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 5_000_000
+    timeline = randomTimeline(n)
+    start = perf_counter()
+    transformed = pipeline().apply(timeline)
+    elapsed = perf_counter() - start
+    print(f'pipeline      {n:>10} events  {elapsed * 1e3:8.1f} ms  {elapsed / n * 1e9:6.1f} ns/event  -> {len(transformed)} kept')
+
+    sample = [mido.Message.from_bytes(p) for p in randomTimeline(200_000).payloads]
+    start = perf_counter()
+    legacyPerMessage(sample)
+    elapsed = perf_counter() - start
+    print(f'per message   {len(sample):>10} events  {elapsed * 1e3:8.1f} ms  {elapsed / len(sample) * 1e9:6.1f} ns/event')
+
+    # play a slice as fast as possible, profiling every Python call on the scheduler thread
+    head = midiSchedule.Timeline(transformed.events[:100_000])
+    calls = Counter()
+    def profile(frame, event, arg):
+        if event == 'call':
+            calls[frame.f_code.co_filename.rsplit('/', 1)[-1]] += 1
+    port = FakeOutput()
+    scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port))
+    threading.setprofile(profile)
+    scheduler.start()
+    threading.setprofile(None)
+    scheduler.add(head, rate=1e6).done.wait()
+    scheduler.stop()
+    scheduler.join()
+    print(f'played {port.sent} events; Python calls on the playback thread by file: {dict(calls)}')
+    assert calls['midiTransform.py'] == 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# benchmarks/fakeBackend.py
+# A mido backend with FakeOutput ports, for MIDO_BACKEND=fakeBackend (with benchmarks/ on PYTHONPATH).
+
+from fakes import FakeOutput
+
+import mido
+
+OUTPUTS = ['Fake Synth', 'Disklavier MIDI 1']
+INPUTS = ['Fake Keyboard']
+
+def get_devices(**_):
+    return [
+        *({'name': name, 'is_input': False, 'is_output': True} for name in OUTPUTS), 
+        *({'name': name, 'is_input': True, 'is_output': False} for name in INPUTS), 
+    ]
+
+class Output(FakeOutput):
+    def __init__(self, name=None, **_):
+        super().__init__(capacity=1 << 16)
+        self.name = name
+
+class Input(mido.ports.BaseInput):
+    def __init__(self, name=None, callback=None, **_):
+        super().__init__(name)
+        self.callback = callback
@@ -0,0 +1,91 @@
+# benchmarks/fakes.py
+# Stand-ins for MIDI hardware and concert material, shared by the benchmarks.
+
+from __future__ import annotations
+
+import os
+import sys
+import random
+from time import perf_counter
+
+import mido
+
+# make the top-level modules importable when running `python benchmarks/xxx.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeOutput(mido.ports.BaseOutput):
+    '''
+    Records when each message arrives. Accepts both mido messages and raw bytes.
+    '''
+    def __init__(self, capacity: int = 1 << 20):
+        super().__init__('fake')
+        self.stamps = [0.0] * capacity
+        self.messages: list = [None] * capacity
+        self.sent = 0
+
+    def _send(self, msg):
+        self.stamps[self.sent] = perf_counter()
+        self.messages[self.sent] = msg
+        self.sent += 1
+
+    def send_message(self, data):
+        self.stamps[self.sent] = perf_counter()
+        self.messages[self.sent] = data
+        self.sent += 1
+
+    def silent(self) -> bool:
+        '''
+        Whether every note and pedal sent so far has been released.
+        '''
+        down = set()
+        for data in self.messages[:self.sent]:
+            data = data.bytes() if isinstance(data, mido.Message) else data
+            kind, channel = data[0] & 0xF0, data[0] & 0x0F
+            if kind == 0x90 and data[2]:
+                down.add((channel, data[1]))
+            elif kind in (0x80, 0x90):
+                down.discard((channel, data[1]))
+            elif kind == 0xB0 and data[1] in (64, 66, 67):
+                (down.add if data[2] >= 64 else down.discard)((channel, 'pedal', data[1]))
+        return not down
+
+def makeDenseMidi(
+    filename: str, seconds: float = 10.0, notes_per_second: int = 200, 
+    bpm: int = 120, seed: int = 0, 
+):
+    '''
+    A single-track piano part with random chords, pedal and tempo changes.
+    '''
+    rng = random.Random(seed)
+    mid = mido.MidiFile(ticks_per_beat=480)
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(bpm)))
+    track.append(mido.MetaMessage('time_signature', numerator=4, denominator=4))
+    ticks_per_second = 480 * bpm / 60
+    step = max(1, round(ticks_per_second / notes_per_second * 2))
+    total = round(seconds * ticks_per_second)
+    events = []     # (tick, order, message)
+    for tick in range(0, total, step):
+        for note in rng.sample(range(36, 96), 2):
+            length = rng.randrange(step, step * 8)
+            events.append((tick, 1, mido.Message('note_on', note=note, velocity=rng.randrange(30, 110))))
+            events.append((tick + length, 0, mido.Message('note_off', note=note)))
+    for tick in range(0, total, 480 * 4):
+        events.append((tick, 0, mido.Message('control_change', control=64, value=0)))
+        events.append((tick + 10, 1, mido.Message('control_change', control=64, value=127)))
+    events.sort(key=lambda x: (x[0], x[1]))
+    last = 0
+    for tick, _, msg in events:
+        track.append(msg.copy(time=tick - last))
+        last = tick
+    mid.save(filename)
+    return filename
+
+def percentiles(values: list[float]) -> str:
+    values = sorted(values)
+    if not values:
+        return 'n/a'
+    def at(q: float):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return f'p50 {at(.5) * 1e3:8.3f} ms   p99 {at(.99) * 1e3:8.3f} ms   max {values[-1] * 1e3:8.3f} ms'
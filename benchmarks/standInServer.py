@@ -0,0 +1,75 @@
+# benchmarks/standInServer.py
+# A local Flask stand-in for the text-to-MIDI server. Jobs take a random time to generate.
+
+from __future__ import annotations
+
+import io
+import random
+import logging
+import threading
+import itertools
+from time import perf_counter
+
+import mido
+from flask import Flask, jsonify, send_file
+from werkzeug.serving import make_server
+
+def tinyMidi() -> bytes:
+    mid = mido.MidiFile()
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    for note in (60, 64, 67, 72):
+        track.append(mido.Message('note_on', note=note, velocity=64, time=0))
+        track.append(mido.Message('note_off', note=note, time=240))
+    buf = io.BytesIO()
+    mid.save(file=buf)
+    return buf.getvalue()
+
+class StandInServer:
+    '''
+    Serves the four endpoints TextToMidiClient uses, on a background thread.
+    `completed_at[job_id]` is when the job finished generating, in perf_counter() time.
+    '''
+    def __init__(self, min_duration: float = 0.5, max_duration: float = 3.0, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.ready_at: dict[str, float] = {}
+        self.completed_at: dict[str, float] = {}
+        self.submissions = 0
+        self.midi = tinyMidi()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        app = Flask(__name__)
+        app.add_url_rule('/submit-text', view_func=self.submit, methods=['POST'])
+        app.add_url_rule('/check-status/<job_id>', view_func=self.status)
+        app.add_url_rule('/get-result/<job_id>', view_func=self.result)
+        app.add_url_rule('/download-midi/<job_id>', view_func=self.download)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def submit(self):
+        with self._lock:
+            job_id = f'job{next(self._ids)}'
+            self.submissions += 1
+            duration = self.rng.uniform(self.min_duration, self.max_duration)
+            self.ready_at[job_id] = perf_counter() + duration
+            self.completed_at[job_id] = self.ready_at[job_id]
+        return jsonify(jobId=job_id)
+
+    def status(self, job_id):
+        if job_id not in self.ready_at:
+            return jsonify(error='no such job'), 404
+        done = perf_counter() >= self.ready_at[job_id]
+        return jsonify(status='completed' if done else 'processing')
+
+    def result(self, job_id):
+        return jsonify(metaData={'jobId': job_id})
+
+    def download(self, job_id):
+        return send_file(io.BytesIO(self.midi), mimetype='audio/midi')
@@ -6,43 +6,200 @@ from __future__ import annotations
 import typing as tp
 import threading
 import os
+import re
+from time import perf_counter
 
-import mido
+# Everything below is imported on first use, or by MidiPlayer's start-up thread,
+# so that importing this module (the tool registry) takes milliseconds.
+if tp.TYPE_CHECKING:
+    import midiTransform
+    import playbackService
 
-import generateMidiTool
+# The score for the realtime accompaniment: the soloist's part on SOLO_CHANNEL, the piano on the rest.
+ACCOMPANIMENT_SCORE = 'storage/accompaniment.mid'
+SOLO_CHANNEL = 0
+
+# Regexes (case-insensitive, matched anywhere in the port name) that pick the MIDI ports without asking.
+# An empty input pattern means no input port.
+OUTPUT_PORT_ENV = 'CHATPIANO_OUTPUT_PORT'
+INPUT_PORT_ENV = 'CHATPIANO_INPUT_PORT'
 
 def playAccompanimentTrackRealtimeTempo(*_, **__):
+    player = MidiPlayer.singleton
+    if player is None:
+        raise ValueError('MidiPlayer is not initialized. You need to call MidiPlayer() at the start of everything.')
+    player.waitReady()
+    if player.input_name is None:
+        return 'Error. No MIDI input port was selected, so the soloist cannot be followed.'
+    if not os.path.isfile(ACCOMPANIMENT_SCORE):
+        return 'Error. The accompaniment score does not exist.'
     print('Time for Yuxuan to bring it on!')
+    thread = threading.Thread(target=player.accompany, args=(ACCOMPANIMENT_SCORE, SOLO_CHANNEL))
+    thread.start()
     return 'Success. Now shut up and don\'t say a word.'
 
+def pickPort(names: tp.Sequence[str], pattern: str) -> str:
+    '''
+    The first of `names` that the regex `pattern` matches, ignoring case.
+    '''
+    regex = re.compile(pattern, re.IGNORECASE)
+    for name in names:
+        if regex.search(name):
+            return name
+    raise ValueError(f'No MIDI port matches {pattern!r}. Available: {list(names)}')
+
+def askPort(names: tp.Sequence[str], prompt: str, optional: bool = False) -> str | None:
+    for i, name in enumerate(names):
+        print(i, name, sep = '\t')
+    choice = input(prompt)
+    if optional and not choice:
+        return None
+    return names[int(choice)]
+
 class MidiPlayer:
     singleton: MidiPlayer | None = None
 
-    def __new__(cls) -> MidiPlayer:
+    def __new__(cls, *_, **__) -> MidiPlayer:
         if cls.singleton is None:
             cls.singleton = super().__new__(cls)
         return cls.singleton
     
-    def __init__(self):
-        # ask for output port
-        outputs = mido.get_output_names()   # type: ignore
-        for i, name in enumerate(outputs):
-            print(i, name, sep = '\t')
-        selected = outputs[int(input('> '))]
-        print(f'{selected = }')
-        self.output_name = selected
-    
+    def __init__(self, output_port: str | None = None, input_port: str | None = None):
+        '''
+        `output_port`, `input_port`: regexes picking the ports; default to the
+        CHATPIANO_OUTPUT_PORT and CHATPIANO_INPUT_PORT environment variables.  
+        Without an output pattern, asks on the console for both ports, as before.  
+        Either way, the port is opened and the player warmed up on a background
+        thread; the playback tools wait for it.  
+        Later calls return the same player, already set up; their arguments are ignored.  
+        MIDI files are compiled, and previews rendered, in spawned processes, which
+        import `__main__` again: a host script must call this under `if __name__ == '__main__':`.  
+        '''
+        if hasattr(self, '_ready'):
+            return      # Python runs __init__ again on the singleton
+        if output_port is None:
+            output_port = os.environ.get(OUTPUT_PORT_ENV)
+        if input_port is None:
+            input_port = os.environ.get(INPUT_PORT_ENV, '')
+        self.output_name: str | None = None
+        self.input_name: str | None = None
+        self._playback: playbackService.PlaybackService | None = None
+        self._playback_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._startup_error: Exception | None = None
+        if output_port is None:
+            import mido
+            self.output_name = askPort(mido.get_output_names(), '> ')   # type: ignore
+            print(f'{self.output_name = }')
+            # the input port is where the soloist plays. Empty for none.
+            self.input_name = askPort(mido.get_input_names(), 'input > ', optional=True)   # type: ignore
+            print(f'{self.input_name = }')
+        threading.Thread(
+            target=self._startUp, args=(output_port, input_port), name='MidiPlayerStartUp', daemon=True, 
+        ).start()
+
+    def _startUp(self, output_port: str | None, input_port: str):
+        try:
+            import mido
+            if output_port is not None:
+                self.output_name = pickPort(mido.get_output_names(), output_port)   # type: ignore
+                self.input_name = pickPort(mido.get_input_names(), input_port) if input_port else None   # type: ignore
+                print(f'{self.output_name = }, {self.input_name = }')
+            self._open()
+            import scoreFollower   # the rest of the player, for accompany()
+        except Exception as e:
+            print(f'Cannot start the MIDI player: {e}')
+            self._startup_error = e
+        finally:
+            self._ready.set()
+        # compile the set list before the show, so "play" goes straight to the first note
+        import timelineCache
+        timelineCache.default.warmUp()
+        # previews of every piece that lands in storage/, generated or copied in
+        import audioRender
+        if audioRender.available():
+            audioRender.default.watch()
+
+    def waitReady(self, timeout: float | None = None) -> bool:
+        '''
+        Blocks until the ports are picked and the output is open. Returns False on timeout.
+        Raises whatever stopped the start-up.
+        '''
+        if not self._ready.wait(timeout):
+            return False
+        if self._startup_error is not None:
+            raise self._startup_error
+        return True
+
+    @property
+    def playback(self) -> playbackService.PlaybackService:
+        '''
+        The output port stays open for the session.
+        '''
+        self.waitReady()
+        return self._open()
+
+    def _open(self) -> playbackService.PlaybackService:
+        with self._playback_lock:
+            if self._playback is None:
+                import mido
+                import playbackService
+                port = mido.open_output(self.output_name)    # type: ignore
+                self._playback = playbackService.PlaybackService(port)
+            return self._playback
+
     @classmethod
-    def startPlaying(cls, filename: str):
+    def startPlaying(cls, filename: str, merge: bool = False):
         if cls.singleton is None:
             raise ValueError('MidiPlayer is not initialized. You need to call MidiPlayer() at the start of everything.')
         if not os.path.isfile(filename):
             print('Error. The file does not exist.')
             return 'Error. The file does not exist.'
-        thread = threading.Thread(target=cls.singleton.play, args=(filename, ))
-        thread.start()
+        playback = cls.singleton.playback
+        busy = playback.busy()
+        playback.enqueue(filename, merge=merge)
+        if busy and not merge:
+            return 'Success. The MIDI file is queued and will play right after the current piece. Silently wait for it to finish.'
         return 'Success. The player piano has started playing the MIDI file. Silently wait for it to finish.'
 
+    @classmethod
+    def _service(cls) -> playbackService.PlaybackService:
+        if cls.singleton is None:
+            raise ValueError('MidiPlayer is not initialized. You need to call MidiPlayer() at the start of everything.')
+        return cls.singleton.playback
+
+    @classmethod
+    def stopPlaying(cls):
+        playback = cls._service()
+        if not playback.busy():
+            return 'Nothing is playing.'
+        playback.stopAll()
+        return 'Success. The player piano has stopped, and the queue is cleared.'
+
+    @classmethod
+    def pausePlaying(cls):
+        if not cls._service().pause():
+            return 'Nothing is playing.'
+        return 'Success. The player piano is paused.'
+
+    @classmethod
+    def resumePlaying(cls):
+        if not cls._service().resume():
+            return 'Nothing is paused.'
+        return 'Success. The player piano has resumed.'
+
+    @classmethod
+    def seekPlaying(cls, seconds: float | None = None, bar: int | None = None):
+        if seconds is None and bar is None:
+            return 'Error. Give either seconds or bar.'
+        position = cls._service().seek(
+            None if seconds is None else float(seconds), 
+            None if bar is None else int(bar), 
+        )
+        if position is None:
+            return 'Nothing is playing.'
+        return f'Success. The piece continues from {position:.1f} seconds in.'
+
     @staticmethod
     def any2zero(x: int):   # an example channel remap
         return 0
@@ -56,51 +213,102 @@ class MidiPlayer:
         filename: str, 
         channel_remap: tp.Callable[[int], int | None] = identity,
         scale_velocity: float = 1.0, 
-        discard_meta: bool = True, 
+        transforms: tp.Sequence[midiTransform.Step] = (), 
         verbose: bool = True, 
     ):
         '''
-        This is blocking.
+        This is blocking. The piece is queued after whatever is playing.
         `channel_remap`: return None to discard message.  
+        `transforms`: more midiTransform steps, applied after the remap and velocity scaling.  
+        All of them run once on the whole Timeline before the clock starts; playback itself only sends.  
         '''
-        with mido.open_output(self.output_name) as port:    # type: ignore
-            down_keys = set()
-            with mido.MidiFile(filename) as mid:
+        import midiTransform
+        piece = self.playback.enqueue(filename, (
+            midiTransform.ChannelMap(channel_remap), 
+            midiTransform.VelocityCurve.scale(scale_velocity), 
+            *transforms, 
+        ))
+        if verbose:
+            print('playing...')
+        try:
+            while not piece.wait(0.1):
+                pass
+        except KeyboardInterrupt:
+            if verbose:
+                print('Stop. ')
+            self.playback.cancel(piece)
+        if verbose:
+            print('ok')
+
+    def accompany(
+        self, 
+        filename: str, 
+        solo_channel: int, 
+        verbose: bool = True, 
+    ):
+        '''
+        This is blocking.
+        Plays everything in `filename` except `solo_channel`, following the soloist on the input port.  
+        '''
+        import mido
+        import scoreFollower
+        import timelineCache
+        timeline = timelineCache.load(filename)
+        solo, accompaniment = scoreFollower.splitChannel(timeline, solo_channel)
+        follower = scoreFollower.ScoreFollower(solo)
+        accompaniment.payloads   # pack before the clock starts
+        accompaniment.checkpoints
+        playback = self.playback
+        origin = None
+        if len(follower.onset_times) and (
+            len(accompaniment) == 0 
+            or follower.onset_times[0] <= accompaniment.events['time'][0]
+        ):
+            origin = float('inf')  # the soloist enters first; wait
+        # through the service, so stopping and pausing the piano cover it too
+        piece = playback.attach(accompaniment, origin, filename)
+        stream = piece.stream
+        def onMessage(msg):
+            if msg.type == 'note_on' and msg.velocity != 0:
+                time_map = follower.onset(msg.note, perf_counter())
+                if time_map is not None and stream.held_at is None:    # paused: stay put
+                    playback.scheduler.retime(stream, *time_map)
+        with mido.open_input(self.input_name, callback=onMessage):  # type: ignore
+            if verbose:
+                print('accompanying...')
+            try:
+                while not stream.done.wait(0.1):
+                    pass
+            except KeyboardInterrupt:
                 if verbose:
-                    print('playing...')
-                try:
-                    for msg in mid.play(meta_messages = not discard_meta):
-                        if verbose:
-                            print(msg)
-                        try:
-                            msg.velocity = round(msg.velocity * scale_velocity)
-                            new_channel = channel_remap(msg.channel)
-                            if new_channel is None:
-                                continue
-                            msg.channel = new_channel
-                        except AttributeError:
-                            pass    # allow control_change
-                        port.send(msg)
-                        if msg.type == 'note_on' and msg.velocity != 0:
-                            down_keys.add(msg.note)
-                        elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
-                            down_keys.discard(msg.note)
-                except KeyboardInterrupt:
-                    if verbose:
-                        print('Stop. ')
-                finally:
-                    port.panic()
-                    # in case the MIDI device did not implement panic
-                    for note in down_keys:
-                        port.send(mido.Message('note_off', note=note))
+                    print('Stop. ')
+                playback.cancel(piece)
         if verbose:
             print('ok')
 
+# The generation client (requests and friends) loads on the first generation call.
+def generate_midi(text_command: str):
+    import generateMidiTool
+    return generateMidiTool.generate_midi(text_command)
+
+def check_generate_midi_status(job_id: str | None = None):
+    import generateMidiTool
+    return generateMidiTool.check_generate_midi_status(job_id)
+
+def get_performance_stats(*_, **__):
+    import perfStats
+    return perfStats.get_performance_stats()
+
 FUNCTION_MAPPING = {
     "playAccompanimentTrackRealtimeTempo": playAccompanimentTrackRealtimeTempo,
     "playMidiOnPiano": MidiPlayer.startPlaying,
-    "generate_midi": generateMidiTool.generate_midi, 
-    "check_generate_midi_status": generateMidiTool.check_generate_midi_status,
+    "stopMidiOnPiano": MidiPlayer.stopPlaying,
+    "pauseMidiOnPiano": MidiPlayer.pausePlaying,
+    "resumeMidiOnPiano": MidiPlayer.resumePlaying,
+    "seekMidiOnPiano": MidiPlayer.seekPlaying,
+    "generate_midi": generate_midi, 
+    "check_generate_midi_status": check_generate_midi_status,
+    "get_performance_stats": get_performance_stats,
 }
 
 TOOLS_DEFINE = [
@@ -121,19 +329,83 @@ TOOLS_DEFINE = [
         "type": "function",
         "function": {
             "name": "playMidiOnPiano",
-            "description": "Starts to play a MIDI file on the player piano.",
+            "description": "Starts to play a MIDI file on the player piano. If a piece is already playing, the file is queued to follow it without a gap.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "filename": {
                         "type": "string",
                         "description": "The Midi file to play."
+                    },
+                    "merge": {
+                        "type": "boolean",
+                        "description": "Start right away, layered over whatever is playing, instead of queueing after it. Defaults to false."
                     }
                 },
                 "required": ["filename"]
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "stopMidiOnPiano",
+            "description": "Stops the player piano at once and clears the queue of pieces.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "pauseMidiOnPiano",
+            "description": "Pauses the piece the player piano is playing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "resumeMidiOnPiano",
+            "description": "Resumes the paused piece where it was paused.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "seekMidiOnPiano",
+            "description": "Jumps the current piece to a time or to the start of a bar. Give either seconds or bar. A paused piece stays paused.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "seconds": {
+                        "type": "number",
+                        "description": "Seconds from the start of the piece."
+                    },
+                    "bar": {
+                        "type": "integer",
+                        "description": "Bar number, starting from 1."
+                    }
+                },
+                "required": []
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -155,7 +427,24 @@ TOOLS_DEFINE = [
         "type": "function",
         "function": {
             "name": "check_generate_midi_status",
-            "description": "Obtain whether the previously initated MIDI generation job is completed.",
+            "description": "Obtain whether the previously initated MIDI generation jobs are completed. Without a job ID, reports every job whose outcome has not been reported yet.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "string",
+                        "description": "The job ID returned by generate_midi."
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_performance_stats",
+            "description": "Reports how late the piano has been getting its notes (percentiles and a histogram) and how long each stage of MIDI generation has taken.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -1,37 +1,40 @@
 # %%
-import time
 import requests
-from midi2audio import FluidSynth
-from IPython.display import Audio, display
+import requests.adapters
 
 class TextToMidiClient:
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_size=32):
         self.base_url = base_url.rstrip('/')
+        # one keep-alive connection pool shared by every job
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def submit_text(self, text):
         url = f"{self.base_url}/submit-text"
         headers = {'Content-Type': 'application/json'}
         data = {'text': text}
 
-        response = requests.post(url, json=data, headers=headers)
+        response = self.session.post(url, json=data, headers=headers)
         response.raise_for_status()
         return response.json()
 
     def check_status(self, job_id):
         url = f"{self.base_url}/check-status/{job_id}"
-        response = requests.get(url)
+        response = self.session.get(url)
         response.raise_for_status()
         return response.json()
 
     def get_result(self, job_id):
         url = f"{self.base_url}/get-result/{job_id}"
-        response = requests.get(url)
+        response = self.session.get(url)
         response.raise_for_status()
         return response.json()
 
     def download_midi(self, job_id, save_path):
         url = f"{self.base_url}/download-midi/{job_id}"
-        response = requests.get(url, stream=True)
+        response = self.session.get(url, stream=True)
         response.raise_for_status()
 
         with open(save_path, 'wb') as f:
@@ -44,81 +47,210 @@ text2midi_client = TextToMidiClient(base_url="http://localhost:5000")
 
 
 # %%
-# Define an assistant tool to handle music conversion
-def convert_text_to_midi(text_command):
-    try:
-        # Step 1: Submit text for MIDI conversion
-        submit_response = text2midi_client.submit_text(text_command)
-        job_id = submit_response['jobId']
-        print(f"Job submitted. Job ID: {job_id}")
+import os
+import random
+from generationCache import GenerationCache
+import asyncio
+import threading
+import itertools
+from time import perf_counter
+
+import perfStats
+import audioRender
+
+# Status polling backs off from POLL_MIN to POLL_MAX seconds, with jitter.
+POLL_MIN = 0.25
+POLL_MAX = 5.0
+POLL_BACKOFF = 1.6
+POLL_JITTER = 0.2
+# Server statuses that mean the job has not started generating.
+QUEUED_STATUSES = ('submitted', 'queued', 'pending', 'waiting')
+
+class GenerationJob:
+    def __init__(self, id, text_command):
+        self.id = id
+        self.text_command = text_command
+        self.status = 'submitting'  # then whatever the server reports, then 'completed' or 'failed'
+        self.server_job_id = None
+        self.result = None  # (midi_file_path, meta_data) once completed
+        self.error = None
+        self.reported = False   # whether the tool layer has told the LLM how it ended
+        self.done = threading.Event()
+        self.callbacks = []     # called with the job when it finishes, on the event loop thread
+        self.spans = {}         # stage -> seconds
+
+    def span(self, stage, since):
+        '''
+        Records that `stage` ran from `since` until now. Returns now.
+        '''
+        now = perf_counter()
+        self.spans[stage] = now - since
+        perfStats.generation.add(stage, now - since)
+        return now
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.done.set()
+        for callback in self.callbacks:
+            # the outcome is settled; a failing callback must not change it
+            try:
+                callback(self)
+            except Exception as err:
+                print(f"Job {self.id}: callback {callback.__name__} failed: {err!r}")
+
+class GenerationJobManager:
+    '''
+    Runs every generation job as a coroutine on one event loop, in a daemon thread.
+    HTTP calls go through the client's pooled session in the loop's executor.
+    '''
+    def __init__(self, client, storage_dir='storage'):
+        self.client = client
+        self.storage_dir = storage_dir
+        self.jobs = {}
+        self.listeners = []     # called with every submitted job when it finishes, after its own callbacks
+        self._ids = itertools.count(1)
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='GenerationJobs', daemon=True).start()
+
+    def submit(self, text_command, callbacks=()):
+        job = GenerationJob(str(next(self._ids)), text_command)
+        job.callbacks.extend(callbacks)
+        job.callbacks.extend(self.listeners)
+        self.jobs[job.id] = job
+        asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+        return job
+
+    def record(self, text_command, result):
+        '''
+        Registers a job that is already completed, e.g. served from a cache.
+        '''
+        job = GenerationJob(str(next(self._ids)), text_command)
+        self.jobs[job.id] = job
+        job.finish('completed', result=result)
+        return job
+
+    def run_in_background(self, func, *args):
+        '''
+        Runs func(*args) in the loop's executor. Safe to call from any thread, listeners included.
+        '''
+        self._loop.call_soon_threadsafe(self._loop.run_in_executor, None, func, *args)
 
-        # Step 2: Poll the job status until it's completed
+    async def _run(self, job):
+        status, result, error = await self._attempt(job)
+        job.finish(status, result=result, error=error)
+
+    async def _attempt(self, job):
+        '''
+        Returns (status, result, error).
+        '''
+        started = perf_counter()
+        try:
+            submit_response = await asyncio.to_thread(self.client.submit_text, job.text_command)
+            job.server_job_id = submit_response['jobId']
+            job.status = 'submitted'
+            print(f"Job {job.id} submitted. Server job ID: {job.server_job_id}")
+            if not await self._poll(job, job.span('submit', started)):
+                print(f"Job {job.id} failed.")
+                return 'failed', None, None
+            since = perf_counter()
+            result_response = await asyncio.to_thread(self.client.get_result, job.server_job_id)
+            meta_data = result_response['metaData']
+            os.makedirs(self.storage_dir, exist_ok=True)
+            midi_file_path = await asyncio.to_thread(
+                self.client.download_midi, job.server_job_id, 
+                os.path.join(self.storage_dir, f"{job.server_job_id}.mid"), 
+            )
+            print(f"Job {job.id}: MIDI file downloaded to {midi_file_path}")
+            job.span('download', since)
+            job.span('total', started)
+            return 'completed', (midi_file_path, meta_data), None
+        except requests.HTTPError as http_err:
+            print(f"Job {job.id}: HTTP error occurred: {http_err}")
+            return 'failed', None, str(http_err)
+        except Exception as err:
+            print(f"Job {job.id}: An error occurred: {err}")
+            return 'failed', None, str(err)
+
+    async def _poll(self, job, since):
+        '''
+        Returns whether the job completed.
+        Times the 'queue' and 'generate' stages, as far as polling can see them.
+        '''
+        delay = POLL_MIN
+        stage = 'queue'
         while True:
-            status_response = text2midi_client.check_status(job_id)
-            status = status_response['status']
-            # print(f"Job Status: {status}")
-            if status == 'completed':
-                break
-            elif status == 'failed':
-                print("Job failed.")
-                return None
-            time.sleep(10)  # Wait for 2 seconds before checking again
-
-        # Step 3: Retrieve the result (metadata)
-        result_response = text2midi_client.get_result(job_id)
-        meta_data = result_response['metaData']
-        print("Metadata:")
-        print(meta_data)
-
-        # Step 4: Download the MIDI file
-        midi_file_path = text2midi_client.download_midi(job_id, save_path=f"storage/{job_id}.mid")
-        print(f"MIDI file downloaded to {midi_file_path}")
-
-        return midi_file_path, meta_data
-
-    except requests.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err.response.json()}")
-        return None
+            status_response = await asyncio.to_thread(self.client.check_status, job.server_job_id)
+            job.status = status_response['status']
+            if stage == 'queue' and job.status not in QUEUED_STATUSES:
+                since = job.span(stage, since)
+                stage = 'generate'
+            if job.status == 'completed':
+                job.span(stage, since)
+                return True
+            if job.status == 'failed':
+                return False
+            # the server may say when to ask again; otherwise back off
+            hint = status_response.get('retryAfter')
+            wait = float(hint) if hint is not None else delay
+            await asyncio.sleep(wait * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+            delay = min(delay * POLL_BACKOFF, POLL_MAX)
+
+job_manager = GenerationJobManager(text2midi_client)
+generation_cache = GenerationCache(job_manager)
+perfStats.register('generation_cache', generation_cache.stats)
+
+def render_preview(job):
+    '''
+    Starts an audio preview of each generated piece, where FluidSynth and a soundfont are installed.
+    Hashing the file and starting workers are handed to the executor, off the event loop thread.
+    '''
+    if job.status == 'completed':
+        job_manager.run_in_background(submit_preview, job.result[0])
+
+def submit_preview(midi_file_path):
+    try:
+        if audioRender.available():
+            audioRender.default.render(midi_file_path)
     except Exception as err:
-        print(f"An error occurred: {err}")
-        return None
+        print(f"Cannot render a preview of {midi_file_path}: {err!r}")
 
-# %%
-import threading
-import queue
-import time
-import re
+job_manager.listeners.append(render_preview)
 
-def handle_midi_conversion(text_command, result_queue):
-    """Thread function to handle MIDI conversion and store results."""
-    midi_result = convert_text_to_midi(text_command)
-    result_queue.put(midi_result)  # Place the result in a queue for the main thread to retrieve.
+# Define an assistant tool to handle music conversion
+def convert_text_to_midi(text_command):
+    '''
+    Blocking. Returns (midi_file_path, meta_data), or None on failure.
+    '''
+    job = generation_cache.submit(text_command)
+    job.done.wait()
+    return job.result
 
-result_queue = queue.Queue()
-thread_list = []
+# %%
 def generate_midi(text_command):
-    conversion_thread = threading.Thread(target=handle_midi_conversion,
-                                         args=(text_command, result_queue))
-    conversion_thread.start()
-    thread_list.append(conversion_thread)
-    return "Generation start."
-
-def check_generate_midi_status():
-    # Check if there's a MIDI conversion in progress
-    if thread_list:
-        latest_thread = thread_list[0]
-        if latest_thread.is_alive():
-            return "Generation is ongoing."
-        else:
-            # If the MIDI conversion has finished, handle the result
-            if latest_thread and not latest_thread.is_alive():
-                thread_list.pop()
-                if not result_queue.empty():
-                    midi_result = result_queue.get()
-                    if midi_result:
-                        midi_file_path, meta_data = midi_result
-                        return "Finish generation."
-                    else:
-                        return "Generation failed."
-    else:
-        return "No ongoing generation process."
\ No newline at end of file
+    job = generation_cache.submit(text_command)
+    if job.done.is_set():
+        return describe_job(job)    # the same piece was generated before
+    return f"Generation start. Job ID: {job.id}."
+
+def describe_job(job):
+    if not job.done.is_set():
+        return f"Job {job.id}: Generation is ongoing ({job.status})."
+    job.reported = True
+    if job.status == 'completed':
+        midi_file_path, meta_data = job.result
+        return f"Job {job.id}: Finish generation. MIDI file: {midi_file_path}"
+    return f"Job {job.id}: Generation failed."
+
+def check_generate_midi_status(job_id=None):
+    if job_id is not None:
+        job = job_manager.jobs.get(str(job_id))
+        if job is None:
+            return f"No generation job with ID {job_id}."
+        return describe_job(job)
+    # everything the LLM has not heard the end of yet
+    pending = [job for job in job_manager.jobs.values() if not job.reported]
+    if not pending:
+        return "No ongoing generation process."
+    return '\n'.join(describe_job(job) for job in pending)
@@ -0,0 +1,141 @@
+# generationCache.py
+# Serve repeated text-to-MIDI requests from earlier results instead of generating again.
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import hashlib
+import threading
+from time import perf_counter
+
+INDEX_PATH = 'storage/generationCache.json'
+
+def normalizedKey(text_command: str) -> str:
+    '''
+    Commands that differ only in whitespace or case share a key.
+    '''
+    normalized = ' '.join(text_command.split()).casefold()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+class GenerationCache:
+    '''
+    Sits in front of a GenerationJobManager.
+    A repeated command gets the earlier MIDI file at once, and a command
+    identical to one still generating joins that job instead of submitting
+    another. Entries persist in a JSON index next to the MIDI files; the
+    least recently used are evicted (files included) past `max_entries` or
+    `max_bytes`.
+    '''
+    def __init__(
+        self, manager, index_path: str = INDEX_PATH, 
+        max_entries: int = 256, max_bytes: int = 64 * 2**20, 
+    ):
+        self.manager = manager
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.in_flight = {}     # key -> GenerationJob
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+        self.hit_seconds = 0.0      # total time to answer hits
+        self.miss_seconds = 0.0     # total time from submit to result, for misses that completed
+        self.completed_misses = 0
+        self._lock = threading.Lock()
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def submit(self, text_command: str):
+        '''
+        Returns a GenerationJob, which is already completed on a hit.
+        '''
+        start = perf_counter()
+        key = normalizedKey(text_command)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and os.path.isfile(entry['path']):
+                entry['last_used'] = time.time()
+                self._save()
+                self.hits += 1
+                job = self.manager.record(text_command, (entry['path'], entry['meta_data']))
+                self.hit_seconds += perf_counter() - start
+                return job
+            job = self.in_flight.get(key)
+            if job is not None:
+                self.merged += 1
+                return job
+            self.misses += 1
+            job = self.manager.submit(
+                text_command, callbacks=[lambda job: self._onDone(key, job, start)], 
+            )
+            self.in_flight[key] = job
+            return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses + self.merged
+            return {
+                'entries': len(self.entries), 
+                'hits': self.hits, 
+                'misses': self.misses, 
+                'merged': self.merged, 
+                'hit_rate': (self.hits + self.merged) / requests if requests else 0.0, 
+                'mean_hit_latency': self.hit_seconds / self.hits if self.hits else None, 
+                'mean_miss_latency': self.miss_seconds / self.completed_misses if self.completed_misses else None, 
+            }
+
+    def _onDone(self, key: str, job, start: float):
+        with self._lock:
+            self.in_flight.pop(key, None)
+            if job.status != 'completed':
+                return  # failures are not cached; the next request tries again
+            self.completed_misses += 1
+            self.miss_seconds += perf_counter() - start
+            midi_file_path, meta_data = job.result
+            try:
+                size = os.path.getsize(midi_file_path)
+            except OSError as e:
+                print(f'Not caching {midi_file_path}: {e}')
+                return
+            now = time.time()
+            self.entries[key] = {
+                'path': midi_file_path, 
+                'meta_data': meta_data, 
+                'size': size, 
+                'created': now, 
+                'last_used': now, 
+            }
+            self._evict(keep=key)
+            self._save()
+
+    def _evict(self, keep: str):
+        '''
+        Never evicts `keep`, the entry just added: its file is the result the caller is handed.
+        '''
+        by_age = sorted(self.entries, key=lambda k: self.entries[k]['last_used'])
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key in by_age:
+            if len(self.entries) <= self.max_entries and total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry['size']
+            try:
+                os.remove(entry['path'])
+            except OSError:
+                pass
+
+    def _save(self):
+        directory = os.path.dirname(self.index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        staging = self.index_path + '.tmp'
+        with open(staging, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(staging, self.index_path)
@@ -0,0 +1,479 @@
+# midiSchedule.py
+# Compile a MIDI file into a flat timeline once, then send it against a monotonic clock.
+
+from __future__ import annotations
+
+import typing as tp
+import math
+import heapq
+import bisect
+import threading
+import itertools
+from time import perf_counter
+
+import numpy as np
+import mido
+
+import perfStats
+
+EVENT_DTYPE = np.dtype([
+    ('time', '<f8'),    # absolute, in seconds from the start of the file
+    ('status', 'u1'),
+    ('data1', 'u1'),
+    ('data2', 'u1'),
+])
+
+# Below this much time before a deadline, stop sleeping and spin.
+SPIN_MARGIN = 0.001
+
+class Timeline:
+    '''
+    Channel messages of a MIDI file, in playback order, and where its bars start.
+    Meta messages and sysex are not part of the timeline.
+    '''
+    def __init__(self, events: np.ndarray, bars: np.ndarray | None = None):
+        assert events.dtype == EVENT_DTYPE
+        self.events = events
+        self.bars = np.zeros(1) if bars is None else bars   # seconds at the start of each bar
+        self._payloads: list[bytes] | None = None
+        self._checkpoints: Checkpoints | None = None
+
+    def derive(self, events: np.ndarray) -> Timeline:
+        '''
+        A Timeline of modified `events` on the same bars.
+        '''
+        return Timeline(events, self.bars)
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def duration(self) -> float:
+        if len(self.events) == 0:
+            return 0.0
+        return float(self.events['time'][-1])
+
+    @property
+    def payloads(self) -> list[bytes]:
+        '''
+        Raw bytes of every event, built once so the send loop allocates nothing.
+        '''
+        if self._payloads is None:
+            self._payloads = packPayloads(self.events)
+        return self._payloads
+
+    @property
+    def checkpoints(self) -> Checkpoints:
+        if self._checkpoints is None:
+            self._checkpoints = Checkpoints(self.events)
+        return self._checkpoints
+
+def messageSize(status: np.ndarray) -> np.ndarray:
+    '''
+    Program change and channel pressure carry one data byte, the rest carry two.
+    '''
+    return np.where((status & 0xE0) == 0xC0, 2, 3)
+
+def packPayloads(events: np.ndarray) -> list[bytes]:
+    packed = np.empty((len(events), 3), dtype=np.uint8)
+    packed[:, 0] = events['status']
+    packed[:, 1] = events['data1']
+    packed[:, 2] = events['data2']
+    buf = packed.tobytes()
+    return [
+        buf[i * 3 : i * 3 + size]
+        for i, size in enumerate(messageSize(events['status']).tolist())
+    ]
+
+def compileMidi(filename: str) -> Timeline:
+    with mido.MidiFile(filename) as mid:
+        ticks_per_beat = mid.ticks_per_beat
+        tempo = mido.midifiles.midifiles.DEFAULT_TEMPO
+        tick = 0
+        now = 0.0
+        rows = []
+        tempo_changes = [(0, 0.0, tempo)]   # (tick, seconds, tempo)
+        signatures = [(0, 4, 4)]            # (tick, numerator, denominator)
+        for msg in mid.merged_track:
+            if msg.time > 0:
+                tick += msg.time
+                now += mido.tick2second(msg.time, ticks_per_beat, tempo)
+            if msg.is_meta:
+                if msg.type == 'set_tempo':
+                    tempo = msg.tempo
+                    tempo_changes.append((tick, now, tempo))
+                elif msg.type == 'time_signature':
+                    signatures.append((tick, msg.numerator, msg.denominator))
+                continue
+            data = msg.bytes()
+            if data[0] >= 0xF0:
+                continue    # sysex and system messages
+            rows.append((now, data[0], data[1], data[2] if len(data) > 2 else 0))
+    bars = barTimes(signatures, tempo_changes, tick, ticks_per_beat)
+    return Timeline(np.array(rows, dtype=EVENT_DTYPE), bars)
+
+def barTimes(
+    signatures: list[tuple[int, int, int]], 
+    tempo_changes: list[tuple[int, float, int]], 
+    end_tick: int, ticks_per_beat: int, 
+) -> np.ndarray:
+    bar_ticks = []
+    for (start, numerator, denominator), (stop, _, _) in zip(
+        signatures, signatures[1:] + [(end_tick + 1, 0, 0)], 
+    ):
+        bar_length = max(1, numerator * ticks_per_beat * 4 // denominator)
+        bar_ticks.extend(range(start, max(start + 1, stop), bar_length))
+    ticks = np.array(sorted(set(bar_ticks)), dtype=np.float64)
+    change_tick, change_seconds, change_tempo = (np.array(x, dtype=np.float64) for x in zip(*tempo_changes))
+    k = np.searchsorted(change_tick, ticks, side='right') - 1
+    return change_seconds[k] + (ticks - change_tick[k]) * change_tempo[k] * 1e-6 / ticks_per_beat
+
+# A snapshot every this many events bounds the replay for any seek.
+CHECKPOINT_EVERY = 512
+
+class ControllerState:
+    '''
+    What the piano has been told so far: held notes, controllers, programs, pitch bend.
+    Notes and controllers are indexed by channel * 128 + number; -1 is never set.
+    Channel mode messages (CC 120 ~ 127) are not controllers: they act on the state instead.
+    '''
+    def __init__(self, velocity=None, cc=None, program=None, bend=None, reset=None):
+        self.velocity = np.zeros(16 * 128, dtype=np.uint8) if velocity is None else velocity   # 0 if not held
+        self.cc = np.full(16 * 128, -1, dtype=np.int16) if cc is None else cc
+        self.program = np.full(16, -1, dtype=np.int16) if program is None else program
+        self.bend = np.full(16, -1, dtype=np.int32) if bend is None else bend
+        self.reset = np.zeros(16, dtype=bool) if reset is None else reset  # got Reset All Controllers
+
+    def copy(self) -> ControllerState:
+        return ControllerState(
+            self.velocity.copy(), self.cc.copy(), self.program.copy(), self.bend.copy(), self.reset.copy(), 
+        )
+
+    def advance(self, events: np.ndarray):
+        status = events['status']
+        kind = status & 0xF0
+        channel = (status & 0x0F).astype(np.intp)
+        data1 = events['data1'].astype(np.intp)
+        data2 = events['data2']
+        index = np.arange(len(events))
+        is_cc = kind == 0xB0
+        # per channel, only what comes after the last reset / all-notes-off counts
+        notes_from = lastPerChannel(channel, index, is_cc & np.isin(data1, NOTES_OFF_MODES))
+        for c in np.flatnonzero(notes_from >= 0).tolist():
+            self.velocity[c * 128 : (c + 1) * 128] = 0
+        controllers_from = lastPerChannel(channel, index, is_cc & (data1 == RESET_CONTROLLERS))
+        for c in np.flatnonzero(controllers_from >= 0).tolist():
+            self.cc[c * 128 + RESET_CCS] = -1
+            self.bend[c] = -1
+            self.reset[c] = True
+        is_note = ((kind == 0x80) | (kind == 0x90)) & (index > notes_from[channel])
+        assignLast(
+            self.velocity, channel[is_note] * 128 + data1[is_note], 
+            np.where(kind[is_note] == 0x90, data2[is_note], 0), 
+        )
+        # a reset only drops the controllers it resets; volume, pan, bank select and the like stay
+        is_cc &= (data1 < CHANNEL_MODE) & ((index > controllers_from[channel]) | ~RESETTABLE[data1])
+        assignLast(self.cc, channel[is_cc] * 128 + data1[is_cc], data2[is_cc])
+        is_program = kind == 0xC0
+        assignLast(self.program, channel[is_program], data1[is_program])
+        is_bend = (kind == 0xE0) & (index > controllers_from[channel])
+        assignLast(self.bend, channel[is_bend], data1[is_bend] | (data2[is_bend].astype(np.int32) << 7))
+
+    def silenceMessages(self) -> list[bytes]:
+        '''
+        Releases held notes, then any pedal that is down.
+        '''
+        messages = [bytes((0x80 | k // 128, k % 128, 0)) for k in np.flatnonzero(self.velocity).tolist()]
+        for pedal in PEDALS:
+            for channel in np.flatnonzero(self.cc[pedal::128] >= 64).tolist():
+                messages.append(bytes((0xB0 | channel, pedal, 0)))
+        return messages
+
+    def restoreMessages(self, restrike: bool = False) -> list[bytes]:
+        '''
+        Brings a silent piano to this state. With `restrike`, held notes sound again.
+        Order: resets, bank selects, programs, other controllers, pitch bend, notes.
+        '''
+        messages = [bytes((0xB0 | c, RESET_CONTROLLERS, 0)) for c in np.flatnonzero(self.reset).tolist()]
+        is_set = self.cc >= 0
+        is_bank = np.zeros(16 * 128, dtype=bool)
+        for number in BANK_SELECT:
+            is_bank[number::128] = True
+        messages.extend(
+            bytes((0xB0 | k // 128, k % 128, self.cc[k])) for k in np.flatnonzero(is_set & is_bank).tolist()
+        )
+        messages.extend(bytes((0xC0 | c, p)) for c, p in enumerate(self.program.tolist()) if p >= 0)
+        messages.extend(
+            bytes((0xB0 | k // 128, k % 128, self.cc[k])) for k in np.flatnonzero(is_set & ~is_bank).tolist()
+        )
+        messages.extend(
+            bytes((0xE0 | c, b & 0x7F, b >> 7)) for c, b in enumerate(self.bend.tolist()) if b >= 0
+        )
+        if restrike:
+            messages.extend(
+                bytes((0x90 | k // 128, k % 128, self.velocity[k])) 
+                for k in np.flatnonzero(self.velocity).tolist()
+            )
+        return messages
+
+def lastPerChannel(channel: np.ndarray, index: np.ndarray, where: np.ndarray) -> np.ndarray:
+    '''
+    Per channel, the last index where `where` holds, or -1.
+    '''
+    last = np.full(16, -1, dtype=np.intp)
+    np.maximum.at(last, channel[where], index[where])
+    return last
+
+# sustain, sostenuto, soft
+PEDALS = (64, 66, 67)
+# bank select MSB, LSB; they only take effect with the next program change
+BANK_SELECT = (0, 32)
+# control changes from here on are channel mode messages
+CHANNEL_MODE = 120
+RESET_CONTROLLERS = 121
+# all sound off, all notes off, omni off / on, mono on, poly on: each also releases the notes
+NOTES_OFF_MODES = (120, 123, 124, 125, 126, 127)
+# what Reset All Controllers resets (RP-015): not bank select, volume, pan, sound controllers or effect depths
+RESET_CCS = np.array([
+    n for n in range(CHANNEL_MODE) 
+    if n not in (0, 32, 7, 39, 10, 42, *range(70, 80), *range(91, 96))
+])
+RESETTABLE = np.zeros(128, dtype=bool)
+RESETTABLE[RESET_CCS] = True
+
+def assignLast(target: np.ndarray, keys: np.ndarray, values: np.ndarray):
+    '''
+    target[keys] = values, where the last of repeated keys wins.
+    '''
+    unique, last = np.unique(keys[::-1], return_index=True)
+    target[unique] = values[::-1][last]
+
+class Checkpoints:
+    '''
+    ControllerState snapshots every `every` events, so the state before any
+    event is one snapshot plus at most `every` events replayed.
+    '''
+    def __init__(self, events: np.ndarray, every: int = CHECKPOINT_EVERY):
+        self.events = events
+        self.every = every
+        n = len(events) // every + 1
+        self.velocity = np.empty((n, 16 * 128), dtype=np.uint8)
+        self.cc = np.empty((n, 16 * 128), dtype=np.int16)
+        self.program = np.empty((n, 16), dtype=np.int16)
+        self.bend = np.empty((n, 16), dtype=np.int32)
+        self.reset = np.empty((n, 16), dtype=bool)
+        state = ControllerState()
+        for i in range(n):
+            self.velocity[i] = state.velocity
+            self.cc[i] = state.cc
+            self.program[i] = state.program
+            self.bend[i] = state.bend
+            self.reset[i] = state.reset
+            state.advance(events[i * every : (i + 1) * every])
+
+    def stateAt(self, cursor: int) -> ControllerState:
+        '''
+        The state after the first `cursor` events.
+        '''
+        i = cursor // self.every
+        state = ControllerState(
+            self.velocity[i].copy(), self.cc[i].copy(), self.program[i].copy(), self.bend[i].copy(), 
+            self.reset[i].copy(), 
+        )
+        state.advance(self.events[i * self.every : cursor])
+        return state
+
+def rawSender(port) -> tp.Callable[[bytes], None]:
+    '''
+    Returns a function that sends raw MIDI bytes on `port`.
+    mido's rtmidi backend takes bytes directly, skipping mido.Message construction.
+    '''
+    for candidate in (port, getattr(port, '_rt', None)):
+        send_message = getattr(candidate, 'send_message', None)
+        if send_message is not None:
+            return send_message
+    return lambda data: port.send(mido.Message.from_bytes(data))
+
+class Stream:
+    '''
+    A Timeline being played by a Scheduler, with its own time map (origin, rate):
+        deadline = origin + event time / rate
+    `origin` is the perf_counter() at which score time 0 falls; `rate` is
+    score seconds per wall-clock second. An infinite origin holds the stream.
+    '''
+    def __init__(self, timeline: Timeline, origin: float, rate: float = 1.0):
+        self.timeline = timeline
+        self.times = timeline.events['time'].tolist()
+        self.payloads = timeline.payloads   # may be swapped for a same-length list mid-flight
+        self.time_map = (origin, rate)
+        self.cursor = 0     # number of events sent
+        self.cancelled = False
+        self.seek_to: float | None = None   # score time of a jump the scheduler has yet to make
+        self.held_at: float | None = None   # score time where the stream is paused
+        self.done = threading.Event()
+
+    def position(self) -> float:
+        '''
+        The score time being played now.
+        '''
+        if self.held_at is not None:
+            return self.held_at
+        origin, rate = self.time_map
+        return min(max((perf_counter() - origin) * rate, 0.0), self.timeline.duration)
+
+    def deadline(self) -> float:
+        origin, rate = self.time_map
+        return origin + self.times[self.cursor] / rate
+
+    def end(self) -> float:
+        '''
+        When the last event is due.
+        '''
+        origin, rate = self.time_map
+        return origin + self.timeline.duration / rate
+
+class Scheduler(threading.Thread):
+    '''
+    Sends any number of Streams on one dedicated thread, heap-merged by deadline.
+    Deadlines are absolute, so timing error does not accumulate.
+    Waits sleep until `spin_margin` before the deadline, then spin.
+    Lives as long as the output port; add streams as they come.
+    '''
+    def __init__(
+        self,
+        send: tp.Callable[[bytes], None],
+        spin_margin: float = SPIN_MARGIN,
+        recorder: perfStats.EventRecorder | None = perfStats.playback,
+    ):
+        super().__init__(name='MidiScheduler', daemon=True)
+        self.send = send
+        self.spin_margin = spin_margin
+        self.recorder = recorder    # None turns the instrumentation off
+        self.streams: list[Stream] = []
+        self._changed = False
+        self._stopped = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._order = itertools.count()     # tie-breaker among equal deadlines
+
+    def add(self, timeline: Timeline, origin: float | None = None, rate: float = 1.0) -> Stream:
+        stream = Stream(timeline, perf_counter() if origin is None else origin, rate)
+        with self._lock:
+            self.streams.append(stream)
+        self._poke()
+        return stream
+
+    def retime(self, stream: Stream, origin: float, rate: float = 1.0):
+        stream.time_map = (origin, rate)
+        self._poke()
+
+    def seek(self, stream: Stream, seconds: float, resume_at: float | None):
+        '''
+        Jumps `stream` to score time `seconds`, to continue at wall-clock
+        `resume_at`, or to hold there if None. What was sounding is released,
+        then the controllers, programs and pitch bend at the target are restored.
+        '''
+        rate = stream.time_map[1]
+        stream.held_at = seconds if resume_at is None else None
+        stream.seek_to = seconds
+        stream.time_map = (math.inf if resume_at is None else resume_at - seconds / rate, rate)
+        self._poke()
+
+    def cancel(self, stream: Stream):
+        '''
+        The stream stops, and the notes it left sounding are released.
+        '''
+        stream.cancelled = True
+        self._poke()
+
+    def busy(self) -> bool:
+        return bool(self.streams)
+
+    def stop(self):
+        '''
+        Cancels every stream and ends the thread.
+        '''
+        self._stopped = True
+        self._wake.set()
+
+    def _poke(self):
+        self._changed = True
+        self._wake.set()
+
+    def run(self):
+        send = self.send
+        spin_margin = self.spin_margin
+        wake = self._wake
+        order = self._order
+        record = None if self.recorder is None else self.recorder.record
+        heap: list[tuple[float, int, Stream]] = []
+        while not self._stopped:
+            if self._changed:
+                heap = self._rebuild()
+            if not heap:
+                if wake.wait(1.0):
+                    wake.clear()
+                continue
+            deadline, _, stream = heap[0]
+            remaining = deadline - perf_counter()
+            if remaining > spin_margin:
+                if wake.wait(min(remaining - spin_margin, 1.0)):
+                    wake.clear()    # streams changed; re-evaluate
+                continue
+            while perf_counter() < deadline:
+                pass
+            cursor = stream.cursor
+            if record is None:
+                send(stream.payloads[cursor])
+            else:
+                sent_at = perf_counter()
+                send(stream.payloads[cursor])
+                record(deadline, sent_at, perf_counter())
+            stream.cursor = cursor = cursor + 1
+            if cursor < len(stream.times):
+                heapq.heapreplace(heap, (stream.deadline(), next(order), stream))
+            else:
+                heapq.heappop(heap)
+                self._silence(stream)   # a file may end with notes or pedals still down
+                self._retire(stream)
+        with self._lock:
+            for stream in self.streams:
+                self._silence(stream)
+                stream.done.set()
+            self.streams.clear()
+
+    def _rebuild(self) -> list[tuple[float, int, Stream]]:
+        self._changed = False
+        heap = []
+        for stream in list(self.streams):
+            if stream.cancelled:
+                self._silence(stream)
+                self._retire(stream)
+                continue
+            if stream.seek_to is not None:
+                seconds, stream.seek_to = stream.seek_to, None
+                self._jump(stream, seconds)
+            if stream.cursor >= len(stream.times):
+                self._silence(stream)
+                self._retire(stream)
+            else:
+                heap.append((stream.deadline(), next(self._order), stream))
+        heapq.heapify(heap)
+        return heap
+
+    def _retire(self, stream: Stream):
+        with self._lock:
+            self.streams.remove(stream)
+        stream.done.set()
+
+    def _silence(self, stream: Stream):
+        for data in stream.timeline.checkpoints.stateAt(stream.cursor).silenceMessages():
+            self.send(data)
+
+    def _jump(self, stream: Stream, seconds: float):
+        self._silence(stream)
+        cursor = bisect.bisect_left(stream.times, seconds)
+        if stream.held_at is None:
+            for data in stream.timeline.checkpoints.stateAt(cursor).restoreMessages():
+                self.send(data)
+        stream.cursor = cursor
@@ -0,0 +1,142 @@
+# midiTransform.py
+# Message transforms applied once to a whole Timeline before playback, as array operations.
+
+from __future__ import annotations
+
+import typing as tp
+
+import numpy as np
+
+from midiSchedule import Timeline
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLY_TOUCH = 0xA0
+CONTROL_CHANGE = 0xB0
+
+# The keys of the player piano.
+PIANO_LOW = 21
+PIANO_HIGH = 108
+
+class Step(tp.Protocol):
+    def __call__(self, events: np.ndarray, keep: np.ndarray) -> None:
+        '''
+        Modifies `events` in place. Clears `keep` for events to drop.
+        '''
+        ...
+
+class Pipeline:
+    def __init__(self, *steps: Step):
+        self.steps = steps
+
+    def apply(self, timeline: Timeline) -> Timeline:
+        if not self.steps:
+            return timeline
+        events = timeline.events.copy()
+        keep = np.ones(len(events), dtype=bool)
+        for step in self.steps:
+            step(events, keep)
+        return timeline.derive(events[keep])
+
+def kindOf(events: np.ndarray) -> np.ndarray:
+    return events['status'] & 0xF0
+
+def hasPitch(events: np.ndarray) -> np.ndarray:
+    kind = kindOf(events)
+    return (kind == NOTE_OFF) | (kind == NOTE_ON) | (kind == POLY_TOUCH)
+
+class ChannelMap:
+    '''
+    `mapping`: a function or dict from channel to channel. None drops the channel.
+    Unlisted channels of a dict are kept as they are.
+    '''
+    def __init__(self, mapping: tp.Callable[[int], int | None] | dict[int, int | None]):
+        if isinstance(mapping, dict):
+            table = [mapping.get(c, c) for c in range(16)]
+        else:
+            table = [mapping(c) for c in range(16)]
+        for source, target in enumerate(table):
+            if target is not None and not 0 <= target <= 15:
+                raise ValueError(f'Channel {source} maps to {target}, outside 0-15.')
+        self.drop = np.array([c is None for c in table])
+        self.table = np.array([c or 0 for c in table], dtype=np.uint8)
+
+    def __call__(self, events: np.ndarray, keep: np.ndarray):
+        channel = events['status'] & 0x0F
+        keep &= ~self.drop[channel]
+        events['status'] = (events['status'] & 0xF0) | self.table[channel]
+
+class VelocityCurve:
+    '''
+    Maps note-on velocities through a 128-entry lookup table.
+    Sounding notes stay sounding: velocities never map to 0.
+    '''
+    def __init__(self, table: tp.Sequence[int] | np.ndarray):
+        table = np.clip(np.asarray(table), 1, 127).astype(np.uint8)
+        assert table.shape == (128, )
+        table[0] = 0    # a note-on with velocity 0 is a note-off
+        self.table = table
+
+    @classmethod
+    def scale(cls, factor: float):
+        return cls(np.round(np.arange(128) * factor))
+
+    @classmethod
+    def gamma(cls, exponent: float, low: int = 1, high: int = 127):
+        '''
+        exponent > 1 softens, < 1 hardens. Output spans [low, high].
+        '''
+        x = np.arange(128) / 127
+        return cls(np.round(low + (high - low) * x ** exponent))
+
+    def __call__(self, events: np.ndarray, keep: np.ndarray):
+        is_on = kindOf(events) == NOTE_ON
+        events['data2'][is_on] = self.table[events['data2'][is_on]]
+
+class Transpose:
+    '''
+    Notes pushed outside 0 ~ 127 are dropped.
+    '''
+    def __init__(self, semitones: int):
+        self.semitones = semitones
+
+    def __call__(self, events: np.ndarray, keep: np.ndarray):
+        pitched = hasPitch(events)
+        pitch = events['data1'][pitched].astype(np.int16) + self.semitones
+        inside = (pitch >= 0) & (pitch <= 127)
+        keep[pitched] &= inside
+        events['data1'][pitched] = np.clip(pitch, 0, 127)
+
+class ClampRange:
+    '''
+    Keeps notes within [low, high]. `fold` moves outliers by octaves into range; otherwise they are dropped.
+    '''
+    def __init__(self, low: int = PIANO_LOW, high: int = PIANO_HIGH, fold: bool = True):
+        assert high - low >= 11 or not fold, 'Folding needs at least an octave.'
+        pitch = np.arange(128)
+        if fold:
+            pitch = np.where(pitch < low, pitch + (low - pitch + 11) // 12 * 12, pitch)
+            pitch = np.where(pitch > high, pitch - (pitch - high + 11) // 12 * 12, pitch)
+        self.table = pitch.astype(np.uint8)
+        self.inside = (self.table >= low) & (self.table <= high)
+
+    def __call__(self, events: np.ndarray, keep: np.ndarray):
+        pitched = hasPitch(events)
+        pitch = events['data1'][pitched]
+        keep[pitched] &= self.inside[pitch]
+        events['data1'][pitched] = self.table[pitch]
+
+class FilterCC:
+    '''
+    Drops control changes by controller number: everything in `drop`, or everything not in `only`.
+    '''
+    def __init__(self, drop: tp.Iterable[int] = (), only: tp.Iterable[int] | None = None):
+        allowed = np.zeros(128, dtype=bool) if only is not None else np.ones(128, dtype=bool)
+        if only is not None:
+            allowed[list(only)] = True
+        allowed[list(drop)] = False
+        self.allowed = allowed
+
+    def __call__(self, events: np.ndarray, keep: np.ndarray):
+        is_cc = kindOf(events) == CONTROL_CHANGE
+        keep[is_cc] &= self.allowed[events['data1'][is_cc]]
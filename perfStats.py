@@ -0,0 +1,154 @@
+# perfStats.py
+# Always-on timing instrumentation: how late the piano gets its messages, and how long generation takes.
+
+from __future__ import annotations
+
+import json
+import typing as tp
+import threading
+from collections import deque
+
+import numpy as np
+
+# Bucket edges in seconds: below 0 (early), then 4 per decade from 1 us to 1 s.
+LATENCY_EDGES = np.concatenate([[0.0], np.logspace(-6, 0, 25)])
+
+class Histogram:
+    def __init__(self, edges: np.ndarray = LATENCY_EDGES):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.max = -np.inf
+
+    def add(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side='right'), minlength=len(self.counts))
+        self.total += float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float | None:
+        '''
+        Upper edge of the bucket holding the q-quantile.
+        '''
+        count = self.count
+        if count == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q * count, side='left'))
+        return float(self.edges[i]) if i < len(self.edges) else self.max
+
+    def toDict(self) -> dict:
+        count = self.count
+        return {
+            'count': count,
+            'mean': self.total / count if count else None,
+            'p50': self.quantile(.5),
+            'p99': self.quantile(.99),
+            'max': self.max if count else None,
+            # [upper edge, count]; the first bucket is below 0, the last above 1 s
+            'buckets': [[float(e), int(c)] for e, c in zip([*self.edges, np.inf], self.counts) if c],
+        }
+
+class EventRecorder:
+    '''
+    The Scheduler calls record() once per message. Timestamps go into
+    preallocated lists used as a ring buffer; every `capacity` events (and
+    on snapshot) the pending ones are folded into the histograms in bulk.
+    '''
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.deadline = [0.0] * capacity
+        self.start = [0.0] * capacity
+        self.end = [0.0] * capacity
+        self.index = 0      # next slot to write
+        self.lateness = Histogram()
+        self.send_duration = Histogram()
+        self._folded = 0    # slots before this are in the histograms
+        self._lock = threading.Lock()
+
+    def record(self, deadline: float, start: float, end: float):
+        i = self.index
+        self.deadline[i] = deadline
+        self.start[i] = start
+        self.end[i] = end
+        i += 1
+        if i == self.capacity:
+            with self._lock:
+                self._fold(i)
+                self._folded = self.index = 0
+        else:
+            self.index = i
+
+    def _fold(self, upto: int):
+        lo = self._folded
+        if upto <= lo:
+            return
+        deadline = np.array(self.deadline[lo:upto])
+        start = np.array(self.start[lo:upto])
+        end = np.array(self.end[lo:upto])
+        self.lateness.add(start - deadline)
+        self.send_duration.add(end - start)
+
+    def toDict(self, recent: int = 32) -> dict:
+        with self._lock:
+            upto = self.index
+            self._fold(upto)
+            self._folded = upto
+        slots = [(upto - k - 1) % self.capacity for k in range(recent)]
+        return {
+            'lateness': self.lateness.toDict(),
+            'send_duration': self.send_duration.toDict(),
+            # newest first: [lateness, send duration]; stale slots from before the last wrap included
+            'recent': [[self.start[i] - self.deadline[i], self.end[i] - self.start[i]] for i in slots if self.end[i]],
+        }
+
+class StageLog:
+    '''
+    Durations of named stages, e.g. of a generation job, over the last `history` of each.
+    '''
+    def __init__(self, history: int = 512):
+        self.history = history
+        self.stages: dict[str, deque[float]] = {}
+        self.counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages.setdefault(stage, deque(maxlen=self.history)).append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def toDict(self) -> dict:
+        with self._lock:
+            result = {}
+            for stage, durations in self.stages.items():
+                values = np.array(durations)
+                result[stage] = {
+                    'count': self.counts[stage],
+                    'p50': float(np.quantile(values, .5)),
+                    'p99': float(np.quantile(values, .99)),
+                    'max': float(values.max()),
+                }
+            return result
+
+playback = EventRecorder()
+generation = StageLog()
+_providers: dict[str, tp.Callable[[], dict]] = {
+    'playback': playback.toDict,
+    'generation': generation.toDict,
+}
+
+def register(name: str, provider: tp.Callable[[], dict]):
+    '''
+    Adds another section to the snapshot.
+    '''
+    _providers[name] = provider
+
+def snapshot() -> dict:
+    return {name: provider() for name, provider in _providers.items()}
+
+def get_performance_stats(*_, **__):
+    return json.dumps(snapshot(), indent=1)
@@ -0,0 +1,297 @@
+# playbackService.py
+# One open output port and one Scheduler for the whole session, with a queue of pieces.
+
+from __future__ import annotations
+
+import typing as tp
+import math
+import queue
+import threading
+from time import perf_counter
+
+import numpy as np
+
+import midiSchedule
+import midiTransform
+import timelineCache
+
+class Piece:
+    def __init__(
+        self, filename: str, transforms: tp.Sequence[midiTransform.Step], merge: bool,
+    ):
+        self.filename = filename
+        self.transforms = transforms
+        self.merge = merge
+        self.stream: midiSchedule.Stream | None = None
+        self.error: Exception | None = None
+        self.cancelled = False
+        self.scheduled = threading.Event()  # set once it has a stream, or will never get one
+
+    def wait(self, timeout: float | None = None) -> bool:
+        '''
+        Blocks until the piece has finished. Returns False on timeout.
+        '''
+        if not self.scheduled.wait(timeout):
+            return False
+        return self.stream is None or self.stream.done.wait(timeout)
+
+class PlaybackService:
+    '''
+    Pieces are prepared (loaded, transformed, packed) on a worker thread as
+    soon as they are queued, then scheduled on the Scheduler right away:
+    in order, each starting `gap` seconds after the previous one ends, or
+    overlapping it by `crossfade` seconds with the velocities ramped.
+    Pieces queued with `merge` start at once, mixed with whatever is playing.
+    '''
+    def __init__(self, port, gap: float = 0.0, crossfade: float = 0.0, lead_in: float = 0.02):
+        self.port = port
+        self.gap = gap
+        self.crossfade = crossfade
+        self.lead_in = lead_in  # scheduling headroom for a piece that starts now
+        self.scheduler = midiSchedule.Scheduler(midiSchedule.rawSender(port))
+        self.scheduler.start()
+        self.pieces: list[Piece] = []   # queued or playing, in order
+        self._tail: midiSchedule.Stream | None = None  # the last piece in the sequence
+        self._to_prepare: queue.Queue[Piece | None] = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._prepareLoop, name='PlaybackPrepare', daemon=True)
+        self._worker.start()
+
+    def enqueue(
+        self, filename: str, transforms: tp.Sequence[midiTransform.Step] = (), merge: bool = False,
+    ) -> Piece:
+        piece = Piece(filename, transforms, merge)
+        with self._lock:
+            self.pieces.append(piece)
+        self._to_prepare.put(piece)
+        return piece
+
+    def attach(self, timeline: midiSchedule.Timeline, origin: float | None = None, name: str = '') -> Piece:
+        '''
+        Plays a prepared `timeline` at once, merged with the sequence, e.g. one
+        retimed from outside. Stopping and pausing cover it like any other piece.
+        '''
+        piece = Piece(name, (), merge=True)
+        with self._lock:
+            piece.stream = self.scheduler.add(timeline, origin)
+            self.pieces.append(piece)
+        piece.scheduled.set()
+        return piece
+
+    def busy(self) -> bool:
+        with self._lock:
+            self.pieces = [p for p in self.pieces if not p.wait(0)]
+            return bool(self.pieces)
+
+    def cancel(self, piece: Piece):
+        '''
+        Stops or unqueues `piece`. The pieces after it close up the gap.
+        '''
+        piece.cancelled = True
+        with self._lock:
+            was_current = piece is self._current()
+            if piece.stream is not None:
+                self.scheduler.cancel(piece.stream)
+            if piece in self.pieces:
+                self.pieces.remove(piece)
+            if piece.stream is not None and piece.stream is self._tail:
+                self._tail = self._lastScheduled()
+            if was_current:
+                self._takeOver(held=piece.stream.held_at is not None)
+            self._rechain()
+
+    def stopAll(self):
+        with self._lock:
+            pieces, self.pieces = self.pieces, []
+        for piece in pieces:
+            self.cancel(piece)
+
+    def current(self) -> Piece | None:
+        '''
+        The piece of the sequence that is playing or paused.
+        '''
+        with self._lock:
+            return self._current()
+
+    def pause(self) -> bool:
+        '''
+        Holds every playing piece where it is. Returns False if nothing was playing.
+        '''
+        with self._lock:
+            paused = False
+            for piece in self._playing():
+                stream = piece.stream
+                # a stream held at an infinite origin is waiting already, e.g. for the soloist
+                if stream.held_at is None and math.isfinite(stream.time_map[0]):
+                    self.scheduler.seek(stream, stream.position(), None)
+                    paused = True
+            self._rechain()
+            return paused
+
+    def resume(self) -> bool:
+        '''
+        Resumes every paused piece. Returns False if nothing was paused.
+        '''
+        with self._lock:
+            resume_at = perf_counter() + self.lead_in
+            resumed = False
+            for piece in self._playing():
+                stream = piece.stream
+                if stream.held_at is not None:
+                    self.scheduler.seek(stream, stream.held_at, resume_at)
+                    resumed = True
+            self._rechain()
+            return resumed
+
+    def seek(self, seconds: float | None = None, bar: int | None = None) -> float | None:
+        '''
+        Jumps the current piece to `seconds`, or to the start of `bar` (1-based).
+        Stays paused if it was. Returns the score time jumped to, or None if nothing is playing.
+        '''
+        if seconds is None and bar is None:
+            raise ValueError('Give either seconds or bar.')
+        with self._lock:
+            piece = self._current()
+            if piece is None:
+                return None
+            stream = piece.stream
+            if bar is not None:
+                bars = stream.timeline.bars
+                seconds = float(bars[min(max(bar, 1), len(bars)) - 1])
+            seconds = min(max(seconds, 0.0), stream.timeline.duration)
+            resume_at = None if stream.held_at is not None else perf_counter() + self.lead_in
+            self.scheduler.seek(stream, seconds, resume_at)
+            self._rechain()
+            return seconds
+
+    def _playing(self) -> list[Piece]:
+        '''
+        The current piece and any merged over it.
+        '''
+        current = self._current()
+        return [
+            p for p in self.pieces 
+            if (p is current or p.merge) and p.stream is not None and not p.stream.done.is_set()
+        ]
+
+    def _current(self) -> Piece | None:
+        for piece in self.pieces:
+            if not piece.merge and piece.stream is not None and not piece.stream.done.is_set():
+                return piece
+        return None
+
+    def _lastScheduled(self) -> midiSchedule.Stream | None:
+        for piece in reversed(self.pieces):
+            if not piece.merge and piece.stream is not None:
+                return piece.stream
+        return None
+
+    def _takeOver(self, held: bool):
+        '''
+        The next piece in the sequence replaces a cancelled current one: at once, or paused at its start.
+        '''
+        current = self._current()
+        if current is None:
+            return
+        stream = current.stream
+        if held:
+            self.scheduler.seek(stream, 0.0, None)
+        else:
+            start = perf_counter() + self.lead_in
+            if stream.time_map[0] > start:
+                self.scheduler.retime(stream, start, stream.time_map[1])
+
+    def _rechain(self):
+        '''
+        Re-times the scheduled pieces after the current one to follow it again.
+        '''
+        current = self._current()
+        if current is None:
+            return
+        previous = current.stream
+        for piece in self.pieces[self.pieces.index(current) + 1 :]:
+            if piece.merge or piece.stream is None:
+                continue
+            self.scheduler.retime(piece.stream, self._follow(previous.end()), piece.stream.time_map[1])
+            previous = piece.stream
+
+    def _follow(self, end: float) -> float:
+        '''
+        When a piece in the sequence starts, given when the one before ends.
+        '''
+        if self.crossfade > 0:
+            return end - self.crossfade
+        return end + self.gap
+
+    def close(self):
+        self.stopAll()
+        self._to_prepare.put(None)
+        self.scheduler.stop()
+        self.scheduler.join()
+        self.port.panic()
+        self.port.close()
+
+    def _prepareLoop(self):
+        while True:
+            piece = self._to_prepare.get()
+            if piece is None:
+                return
+            if piece.cancelled:
+                piece.scheduled.set()
+                continue
+            try:
+                timeline = midiTransform.Pipeline(*piece.transforms).apply(
+                    timelineCache.load(piece.filename),
+                )
+                timeline.payloads
+                timeline.checkpoints    # so seeking and stopping never build it on the clock
+            except Exception as e:
+                print(f'Cannot play {piece.filename}: {e}')
+                piece.error = e
+                piece.scheduled.set()
+                continue
+            self._schedule(piece, timeline)
+
+    def _schedule(self, piece: Piece, timeline: midiSchedule.Timeline):
+        with self._lock:
+            if piece.cancelled:
+                piece.scheduled.set()
+                return
+            origin = perf_counter() + self.lead_in
+            tail = self._tail
+            if not piece.merge and tail is not None and not tail.done.is_set() and not tail.cancelled:
+                origin = max(origin, self._follow(tail.end()))
+                if self.crossfade > 0 and tail.held_at is None:
+                    self._fadeOut(tail, origin)
+                    timeline = fadeIn(timeline, self.crossfade)
+                    timeline.checkpoints
+            piece.stream = self.scheduler.add(timeline, origin)
+            if not piece.merge:
+                self._tail = piece.stream
+            piece.scheduled.set()
+
+    def _fadeOut(self, stream: midiSchedule.Stream, fade_start: float):
+        '''
+        Ramps down the velocities of `stream` from `fade_start` (wall clock) to its end.
+        '''
+        origin, rate = stream.time_map
+        start = (fade_start - origin) * rate
+        events = stream.timeline.events
+        gain = np.clip(
+            (events['time'][-1] - events['time']) / max(events['time'][-1] - start, 1e-9), 0, 1,
+        )
+        # swap the payloads wholesale; the scheduler picks the new list up on its next event
+        stream.payloads = applyGain(stream.timeline, gain).payloads
+
+def applyGain(timeline: midiSchedule.Timeline, gain: np.ndarray) -> midiSchedule.Timeline:
+    '''
+    Scales note-on velocities by `gain` (per event), keeping sounding notes audible.
+    '''
+    events = timeline.events.copy()
+    is_on = ((events['status'] & 0xF0) == 0x90) & (events['data2'] != 0)
+    velocity = np.round(events['data2'][is_on] * gain[is_on])
+    events['data2'][is_on] = np.clip(velocity, 1, 127)
+    return timeline.derive(events)
+
+def fadeIn(timeline: midiSchedule.Timeline, seconds: float) -> midiSchedule.Timeline:
+    return applyGain(timeline, np.clip(timeline.events['time'] / seconds, 0, 1))
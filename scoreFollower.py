@@ -0,0 +1,148 @@
+# scoreFollower.py
+# Follow a live soloist through the solo part of a score, and re-time the accompaniment to match.
+
+from __future__ import annotations
+
+import math
+from collections import deque
+
+import numpy as np
+
+from midiSchedule import Timeline
+
+# Solo notes closer than this are one onset (a chord).
+CHORD_SPREAD = 0.03
+# Bounds on how far the follower will stretch the nominal tempo.
+MIN_RATE = 0.5
+MAX_RATE = 2.0
+# How much a note's distance from the tempo prediction counts against it, relative to a wrong pitch.
+TIMING_WEIGHT = 0.5
+TIMING_TOLERANCE = 0.5  # seconds of score time
+
+def splitChannel(timeline: Timeline, channel: int) -> tuple[Timeline, Timeline]:
+    '''
+    Returns (events on `channel`, all other events).
+    '''
+    mine = (timeline.events['status'] & 0x0F) == channel
+    return timeline.derive(timeline.events[mine]), timeline.derive(timeline.events[~mine])
+
+def soloOnsets(solo: Timeline) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Groups the note-ons of `solo` into onsets.
+    Returns (onset times, pitch table) where pitch_table[j, p] is True if onset j contains pitch p.
+    '''
+    events = solo.events
+    is_on = ((events['status'] & 0xF0) == 0x90) & (events['data2'] != 0)
+    times = events['time'][is_on]
+    pitches = events['data1'][is_on]
+    if len(times) == 0:
+        return times, np.zeros((0, 128), dtype=bool)
+    new_onset = np.empty(len(times), dtype=bool)
+    new_onset[0] = True
+    new_onset[1:] = np.diff(times) > CHORD_SPREAD
+    onset_index = np.cumsum(new_onset) - 1
+    pitch_table = np.zeros((onset_index[-1] + 1, 128), dtype=bool)
+    pitch_table[onset_index, pitches] = True
+    return times[new_onset], pitch_table
+
+class ScoreFollower:
+    '''
+    Online DTW over a sliding window of `window` score onsets, so each
+    performed note costs O(window) no matter how long the score is.
+    Matched notes become anchors (wall time, score time); the tempo is a
+    least-squares fit over the last `history` anchors, and it in turn
+    discourages alignments far from where the soloist is expected to be.
+    '''
+    def __init__(self, solo: Timeline, window: int = 24, history: int = 8):
+        self.onset_times, pitch_table = soloOnsets(solo)
+        # per onset, a 128-entry list of local costs, so the inner loop indexes plain lists
+        self.costs = (~pitch_table).astype(float).tolist()
+        self.window = window
+        self.anchors: deque[tuple[float, float]] = deque(maxlen=history)
+        self.rate = 1.0
+        self.position = -1  # index of the onset last aligned to; -1 is before the score
+        self._lo = 0
+        self._row = [math.inf] * min(window, len(self.costs))
+        self._before = 0.0  # cost of the virtual column before the first onset
+
+    def onset(self, pitch: int, now: float) -> tuple[float, float] | None:
+        '''
+        Feed one performed note-on.
+        Returns the new time map (origin, rate) if the note anchors the alignment, else None.
+        '''
+        if not self.costs:
+            return None
+        position = self._step(pitch, self._expected(now))
+        if self.costs[position][pitch] != 0.0 or position <= self.position:
+            return None     # wrong note, or another note of the same chord
+        self.position = position
+        self.anchors.append((now, float(self.onset_times[position])))
+        self.rate = self._fitRate()
+        return now - self.anchors[-1][1] / self.rate, self.rate
+
+    def _expected(self, now: float) -> float | None:
+        '''
+        Where the current tempo estimate puts the soloist in score time.
+        '''
+        if not self.anchors:
+            return None
+        wall, score = self.anchors[-1]
+        return score + (now - wall) * self.rate
+
+    def _step(self, pitch: int, expected: float | None) -> int:
+        costs = self.costs
+        lo = self._lo
+        old = self._row
+        new = [0.0] * len(old)
+        if expected is None:
+            prior = [0.0] * len(old)
+        else:
+            # onsets far from where the tempo says we are cost up to TIMING_WEIGHT
+            prior = (
+                np.minimum(np.abs(self.onset_times[lo : lo + len(old)] - expected) / TIMING_TOLERANCE, 1.0) 
+                * TIMING_WEIGHT
+            ).tolist()
+        left = math.inf         # new[k - 1]
+        diag = self._before     # old[k - 1]
+        for k, up in enumerate(old):
+            best = up
+            if left < best:
+                best = left
+            if diag < best:
+                best = diag
+            left = new[k] = best + costs[lo + k][pitch] + prior[k]
+            diag = up
+        if lo == 0:
+            self._before += 1.0     # extra notes before the score starts
+        # keep the numbers small; only their differences matter
+        floor = min(new)
+        new = [x - floor for x in new]
+        self._before -= floor
+        position = lo + new.index(0.0)
+        self._slide(new, position)
+        return position
+
+    def _slide(self, row: list[float], position: int):
+        '''
+        Keep the current position a quarter into the window.
+        '''
+        n = len(self.costs)
+        lo = max(self._lo, min(position - self.window // 4, n - len(row)))
+        shift = lo - self._lo
+        if shift:
+            row = row[shift:] + [math.inf] * shift
+            self._before = math.inf
+            self._lo = lo
+        self._row = row
+
+    def _fitRate(self) -> float:
+        if len(self.anchors) < 2:
+            return self.rate
+        wall = np.array([a[0] for a in self.anchors])
+        score = np.array([a[1] for a in self.anchors])
+        wall -= wall.mean()
+        score -= score.mean()
+        denominator = float(wall @ wall)
+        if denominator == 0.0:
+            return self.rate
+        return min(max(float(wall @ score) / denominator, MIN_RATE), MAX_RATE)
@@ -0,0 +1,136 @@
+# timelineCache.py
+# Compiled Timelines on disk, so starting a piece does not re-parse its MIDI file.
+
+from __future__ import annotations
+
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from midiSchedule import Timeline, compileMidi
+from workerPool import lowPriorityPool, midiFiles, staged
+
+CACHE_DIR = 'storage/.timelines'
+# Bump when compileMidi changes what it produces.
+FORMAT_VERSION = 2
+
+class TimelineCache:
+    '''
+    One directory per compiled file, named by a hash of (path, size, mtime).
+    Arrays are memory-mapped on load. Least recently used entries are
+    evicted once the cache grows past `max_bytes`.
+    Files are compiled in a separate process: mido's parser is pure Python
+    and would hold the GIL against the Scheduler for the whole parse.
+    '''
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = 256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._compiler: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def key(self, filename: str) -> str:
+        stat = os.stat(filename)
+        identity = f'{FORMAT_VERSION}|{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}'
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def load(self, filename: str) -> Timeline:
+        entry = os.path.join(self.directory, self.key(filename))
+        try:
+            return self._open(entry)
+        except FileNotFoundError:
+            self._compile(filename, entry).result()
+        return self._open(entry)
+
+    def _open(self, entry: str) -> Timeline:
+        events = np.load(os.path.join(entry, 'events.npy'), mmap_mode='r')
+        bars = np.load(os.path.join(entry, 'bars.npy'), mmap_mode='r')
+        os.utime(entry)     # mark as recently used
+        return Timeline(events, bars)
+
+    def _compile(self, filename: str, entry: str):
+        '''
+        Compiles `filename` into `entry` in the compiler process. Returns a Future.
+        '''
+        return self._submit(compileEntry, filename, entry, self.directory, self.max_bytes)
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._compiler is None:
+                self._compiler = lowPriorityPool(1)
+            return self._compiler.submit(fn, *args)
+
+    def close(self):
+        with self._lock:
+            if self._compiler is not None:
+                self._compiler.shutdown(cancel_futures=True)
+                self._compiler = None
+
+    def warmUp(self, directory: str = 'storage') -> int:
+        '''
+        Compiles every MIDI file under `directory` that is not cached yet,
+        and starts the compiler process either way, so the first uncached
+        load does not wait for it to spawn. Returns how many files were compiled.
+        '''
+        pending = []
+        for filename in midiFiles(directory):
+            entry = os.path.join(self.directory, self.key(filename))
+            if not os.path.isdir(entry):
+                pending.append((filename, self._compile(filename, entry)))
+        if not pending:
+            self._submit(_ready).result()
+        compiled = 0
+        for filename, future in pending:
+            try:
+                future.result()
+            except (OSError, ValueError, EOFError) as e:
+                print(f'Cannot compile {filename}: {e}')
+                continue
+            compiled += 1
+        return compiled
+
+    def _store(self, entry: str, timeline: Timeline):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with staged(entry, directory=True) as staging:
+                np.save(os.path.join(staging, 'events.npy'), timeline.events)
+                np.save(os.path.join(staging, 'bars.npy'), timeline.bars)
+        except OSError:
+            return  # another process stored it first
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            entries.append((os.stat(entry).st_mtime, size, entry))
+            total += size
+        entries.sort()
+        for _, size, entry in entries[:-1]:     # never evict the newest
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+def _ready():
+    '''
+    Runs in the compiler process; unpickling it imports this module and the compiler with it.
+    '''
+
+def compileEntry(filename: str, entry: str, directory: str, max_bytes: int):
+    '''
+    Runs in the compiler process.
+    '''
+    TimelineCache(directory, max_bytes)._store(entry, compileMidi(filename))
+
+default = TimelineCache()
+
+def load(filename: str) -> Timeline:
+    return default.load(filename)
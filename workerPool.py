@@ -0,0 +1,60 @@
+# workerPool.py
+# Background processes and the files they write, shared by timelineCache and audioRender.
+
+from __future__ import annotations
+
+import typing as tp
+import os
+import glob
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+def lowPriorityPool(workers: int) -> ProcessPoolExecutor:
+    '''
+    Spawned, not forked: the parent runs the scheduler and event loop threads.
+    Workers run at nice 10, so the Scheduler keeps the CPU during a show.
+    Spawning imports the host's `__main__` again in each worker, so a host
+    script must keep its start-up under `if __name__ == '__main__':`, or
+    every worker runs it too.
+    '''
+    return ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'), initializer=_lowerPriority,
+    )
+
+def _lowerPriority():
+    os.nice(10)
+
+def midiFiles(directory: str) -> list[str]:
+    '''
+    Every MIDI file under `directory`, sorted.
+    '''
+    return sorted(
+        glob.glob(os.path.join(directory, '**', '*.mid'), recursive=True)
+        + glob.glob(os.path.join(directory, '**', '*.midi'), recursive=True)
+    )
+
+@contextlib.contextmanager
+def staged(path: str, directory: bool = False) -> tp.Iterator[str]:
+    '''
+    Yields a fresh file (or `directory`) next to `path` to write into, then
+    renames it to `path`, so readers never see a partial one.
+    Removes it if writing or renaming fails.
+    '''
+    parent = os.path.dirname(path)
+    if directory:
+        staging = tempfile.mkdtemp(dir=parent, prefix='.staging-')
+    else:
+        fd, staging = tempfile.mkstemp(dir=parent, prefix='.staging-', suffix=os.path.splitext(path)[1])
+        os.close(fd)
+    try:
+        yield staging
+        os.replace(staging, path)
+    except BaseException:
+        if directory:
+            shutil.rmtree(staging, ignore_errors=True)
+        elif os.path.exists(staging):
+            os.remove(staging)
+        raise